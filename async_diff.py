@@ -0,0 +1,127 @@
+"""
+Async Diff Executor
+Runs many `git diff` subprocesses at once from a single event loop
+"""
+
+import asyncio
+import subprocess
+from contextlib import suppress
+
+from stream_compare import CHUNK_BYTES, diff_command
+
+# git processes allowed in flight at once, and seconds before one is killed
+MAX_IN_FLIGHT = 32
+CALL_TIMEOUT = 60
+
+
+class AsyncDiffer:
+    """Awaitable get_diff: one git process per call, bounded by a semaphore"""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, timeout=CALL_TIMEOUT):
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.timeout = timeout
+        self.calls = 0
+        self.timeouts = 0
+
+    async def get_diff(self, repo_dir, parent, child, path, algorithm):
+        """Same result as simple_analysis.get_diff; None on failure or timeout"""
+        if not parent or not path:
+            return None
+
+        async with self.semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *diff_command(parent, child, path, algorithm),
+                cwd=repo_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+            try:
+                out, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return None
+            finally:
+                # Reached with the process still running on timeout or cancellation
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            self.calls += 1
+
+        if process.returncode:
+            return None
+        return out.decode("utf-8", errors="replace")
+
+    async def compare(self, repo_dir, parent, child, path, chunk_bytes=CHUNK_BYTES):
+        """Awaitable stream_compare.StreamComparer.compare; None on failure or timeout
+
+        The two git processes of a comparison share one semaphore slot.
+        """
+        if not parent or not path:
+            return None
+
+        async with self.semaphore:
+            processes = []
+            try:
+                for algorithm in ("myers", "histogram"):
+                    processes.append(await asyncio.create_subprocess_exec(
+                        *diff_command(parent, child, path, algorithm),
+                        cwd=repo_dir,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT
+                    ))
+                differs = await asyncio.wait_for(compare_streams(processes, chunk_bytes), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return None
+            finally:
+                # Still running after a difference, on timeout or on cancellation
+                for process in processes:
+                    if process.returncode is None:
+                        with suppress(ProcessLookupError):
+                            process.kill()
+                    await process.wait()
+            self.calls += len(processes)
+
+        if differs:
+            return True
+        if any(process.returncode for process in processes):
+            return None
+        return False
+
+
+async def read_chunk(stream, size):
+    """size bytes from stream, fewer only at its end"""
+    try:
+        return await stream.readexactly(size)
+    except asyncio.IncompleteReadError as error:
+        return error.partial
+
+
+async def compare_streams(processes, chunk_bytes):
+    """True at the first differing chunk of the processes' outputs, False if they end identical"""
+    while True:
+        chunks = [await read_chunk(process.stdout, chunk_bytes) for process in processes]
+        if chunks[0] != chunks[1]:
+            return True
+        if not chunks[0]:
+            return False
+
+
+async def gather_in_order(coroutines):
+    """Run coroutines concurrently and return their results in order
+
+    If one fails or the caller is cancelled, the rest are cancelled (which
+    kills their git processes) before the exception propagates.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        # gather has already cancelled every task; let them reap their processes
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -0,0 +1,196 @@
+"""
+Collection Checkpoints
+Append-only row log and manifest of processed commits for resumable runs
+"""
+
+import io
+import json
+import os
+
+import pandas as pd
+
+from log_stream import iter_commits
+
+CHECKPOINT_DIR = "checkpoint"
+
+# Commits buffered in memory before their rows are written out
+FLUSH_COMMITS = 50
+
+# Rows read back at a time when exporting the checkpoint
+CHUNK_ROWS = 10000
+
+
+class Checkpoint:
+    """Rows collected so far plus the (repository, commit) pairs they cover
+
+    rows.csv is appended one batch of commits at a time. Only then are the
+    batch's commits added to manifest.tsv, followed by a "#" line carrying
+    the size rows.csv had after the batch. On reopen both files are cut
+    back to the last complete batch, so a batch interrupted anywhere in
+    between is collected again instead of showing up twice. Commits without
+    rows (root commits, merges) are recorded too, so a rerun only visits
+    commits it has never seen.
+
+    settings, a JSON-serializable dict of whatever decides which commits
+    are collected and what their rows hold, is kept in settings.json. A
+    checkpoint written under other settings (or before settings were
+    recorded) is discarded and collection starts afresh.
+    """
+
+    def __init__(self, directory=CHECKPOINT_DIR, flush_commits=FLUSH_COMMITS, settings=None):
+        self.directory = directory
+        self.flush_commits = flush_commits
+        self.rows_path = os.path.join(directory, "rows.csv")
+        self.manifest_path = os.path.join(directory, "manifest.tsv")
+        self.settings_path = os.path.join(directory, "settings.json")
+        self.done = set()
+        self.pending_rows = []
+        self.pending_commits = []
+        os.makedirs(directory, exist_ok=True)
+        if settings is not None:
+            self.check_settings(settings)
+
+        committed_size = 0
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "rb") as f:
+                data = f.read()
+            batch = []
+            offset = complete = 0
+            for line in data.splitlines(keepends=True):
+                offset += len(line)
+                # A line without its newline was cut off mid-write
+                if not line.endswith(b"\n"):
+                    break
+                fields = line.decode().rstrip("\n").split("\t")
+                if fields[0] == "#":
+                    self.done.update(batch)
+                    batch = []
+                    committed_size = int(fields[1])
+                    complete = offset
+                else:
+                    batch.append((fields[0], fields[1]))
+            if complete != len(data):
+                with open(self.manifest_path, "r+b") as f:
+                    f.truncate(complete)
+
+        with open(self.rows_path, "ab") as f:
+            f.truncate(committed_size)
+        self.columns = None
+        if committed_size:
+            self.columns = list(pd.read_csv(self.rows_path, nrows=0).columns)
+
+    def check_settings(self, settings):
+        """Drop the checkpoint's rows and commits unless they were collected under settings"""
+        # Round-trip so tuples compare equal to the lists read back
+        settings = json.loads(json.dumps(settings))
+        stored = None
+        if os.path.exists(self.settings_path):
+            with open(self.settings_path, encoding="utf-8") as f:
+                stored = json.load(f)
+
+        if stored != settings:
+            if stored is not None:
+                changed = sorted(key for key in settings.keys() | stored.keys()
+                                 if settings.get(key) != stored.get(key))
+                print(f"Checkpoint {self.directory} was collected with other settings "
+                      f"({', '.join(changed)}); collecting afresh")
+            elif os.path.exists(self.manifest_path):
+                print(f"Checkpoint {self.directory} does not record its settings; collecting afresh")
+            for path in (self.rows_path, self.manifest_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        with open(self.settings_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(settings, f, indent=1, sort_keys=True)
+        os.replace(self.settings_path + ".tmp", self.settings_path)
+
+    def seen(self, repo_name):
+        """Shas of a repository already processed by an earlier run"""
+        return {sha for name, sha in self.done if name == repo_name}
+
+    def add(self, repo_name, sha, rows):
+        """Record one processed commit; written out every flush_commits commits"""
+        self.pending_rows.extend(rows)
+        self.pending_commits.append((repo_name, sha))
+        if len(self.pending_commits) >= self.flush_commits:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_commits:
+            return
+
+        with open(self.rows_path, "ab") as f:
+            if self.pending_rows:
+                batch = pd.DataFrame(self.pending_rows)
+                if self.columns is None:
+                    self.columns = list(batch.columns)
+                elif list(batch.columns) != self.columns:
+                    raise ValueError(f"{self.rows_path} holds rows with other columns; "
+                                     f"remove {self.directory} to collect afresh")
+                buffer = io.StringIO()
+                batch.to_csv(buffer, index=False, header=f.tell() == 0)
+                f.write(buffer.getvalue().encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            size = f.tell()
+
+        lines = "".join(f"{repo_name}\t{sha}\n" for repo_name, sha in self.pending_commits)
+        lines += f"#\t{size}\n"
+        with open(self.manifest_path, "ab") as f:
+            f.write(lines.encode())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.done.update(self.pending_commits)
+        self.pending_rows = []
+        self.pending_commits = []
+
+    def load_rows(self, columns=None):
+        """All checkpointed rows, or some of their columns, as a DataFrame of strings"""
+        self.flush()
+        if os.path.getsize(self.rows_path) == 0:
+            return pd.DataFrame(columns=columns)
+        return pd.read_csv(self.rows_path, dtype=str, keep_default_na=False, usecols=columns)
+
+    def iter_rows(self, chunk_rows=CHUNK_ROWS):
+        """Checkpointed rows as DataFrames of at most chunk_rows rows, read lazily"""
+        self.flush()
+        if os.path.getsize(self.rows_path) == 0:
+            return
+        yield from pd.read_csv(self.rows_path, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StreamRows:
+    """Sink for runs without a checkpoint: rows go straight to a DatasetWriter"""
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def seen(self, repo_name):
+        return set()
+
+    def add(self, repo_name, sha, rows):
+        self.writer.write(rows)
+
+    def load_rows(self, columns=None):
+        return pd.DataFrame(columns=columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def commit_positions(repo_path, revisions=("HEAD",)):
+    """{sha: position} of every selected commit, oldest first, as a single fresh run visits them"""
+    return {sha: i for i, sha in enumerate(iter_commits(repo_path, revisions=revisions))}
@@ -0,0 +1,293 @@
+"""
+Dataset Store
+Streaming writer for the repository-partitioned Parquet dataset (or CSV export), and its reader
+"""
+
+import csv
+import hashlib
+import os
+import shutil
+from collections import Counter
+from urllib.parse import quote
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+DATASET_DIR = "dataset"
+DATASET_CSV = "dataset.csv"
+
+# Rows per Parquet row group. Each column of a group is stored in its own
+# compressed chunk, so reading the small columns skips the diff text.
+ROW_GROUP_ROWS = 10000
+
+# Buffered rows are written out every FLUSH_ROWS rows or FLUSH_BYTES of text
+FLUSH_ROWS = ROW_GROUP_ROWS
+FLUSH_BYTES = 64 * 1024 ** 2
+
+# Parsed, typed column selections are cached here by load_dataset()
+LOAD_CACHE_DIR = ".dataset_cache"
+
+# Low-cardinality text columns, loaded as pandas categoricals
+CATEGORY_COLUMNS = ["repository", "file_type", "file_extension"]
+
+SKIPPED_CSV = "skipped_files.csv"
+SKIPPED_COLUMNS = ["repository", "commit_sha", "old_file_path", "new_file_path", "file_type", "skip_reason"]
+
+
+def partition_name(repo_name):
+    """Hive-style directory of one repository's rows"""
+    return f"repository={quote(repo_name, safe='')}"
+
+
+class RunningSummary:
+    """Per-repository file and disagreement counts, kept up to date as rows are written"""
+
+    def __init__(self):
+        self.files = Counter()
+        self.disagreements = Counter()
+        self.skipped = Counter()
+
+    def add(self, row):
+        if row.get("skip_reason"):
+            self.skipped[row["skip_reason"]] += 1
+            return
+        self.files[row["repository"]] += 1
+        if row["discrepancy"] == "Yes":
+            self.disagreements[row["repository"]] += 1
+
+
+class DatasetWriter:
+    """Streams rows into the dataset in bounded memory
+
+    Rows are buffered and written out whenever flush_rows rows or
+    flush_bytes of text are pending: as Parquet row groups of one file per
+    repository, or as blocks of lines of one CSV part per repository that
+    close() joins into a single file. Rows of skipped files go to
+    skipped_files.csv as they come. Analyzed rows also go to results, a
+    results_db.ResultsWriter, and cube, a stats_cube.StatsCube, when given. Everything is staged next to the
+    previous output and swapped in by close(), which first puts back in
+    history order any repository whose commits arrived out of order; that
+    is the only step holding a whole repository's rows in memory.
+    """
+
+    def __init__(self, output_format="parquet", path=None, skipped_path=SKIPPED_CSV,
+                 flush_rows=FLUSH_ROWS, flush_bytes=FLUSH_BYTES, results=None,
+                 cube=None):
+        if output_format == "parquet" and pq is None:
+            raise ImportError("writing the Parquet dataset needs pyarrow; choose the CSV output instead")
+        self.output_format = output_format
+        self.path = path or (DATASET_DIR if output_format == "parquet" else DATASET_CSV)
+        self.staging = self.path + (".tmp" if output_format == "parquet" else ".parts")
+        shutil.rmtree(self.staging, ignore_errors=True)
+        os.makedirs(self.staging)
+        self.flush_rows = flush_rows
+        self.flush_bytes = flush_bytes
+        self.columns = None
+        self.buffers = {}
+        self.pending_rows = 0
+        self.pending_bytes = 0
+        self.parts = {}
+        self.parquet_writers = {}
+        self.summary = RunningSummary()
+        self.results = results
+        self.cube = cube
+
+        self.skipped_path = skipped_path
+        self.skipped_file = open(skipped_path + ".tmp", "w", newline="", encoding="utf-8")
+        self.skipped = csv.DictWriter(self.skipped_file, SKIPPED_COLUMNS, extrasaction="ignore")
+        self.skipped.writeheader()
+
+    def write(self, rows):
+        """Add row dicts, or a DataFrame of rows such as a checkpoint chunk"""
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.to_dict("records")
+        for row in rows:
+            self.summary.add(row)
+            if row.get("skip_reason"):
+                self.skipped.writerow(row)
+                continue
+            if self.results is not None:
+                self.results.add(row)
+            if self.cube is not None:
+                self.cube.add(row)
+            if self.columns is None:
+                self.columns = [column for column in row if column != "skip_reason"]
+            self.buffers.setdefault(row["repository"], []).append(row)
+            self.pending_rows += 1
+            self.pending_bytes += sum(len(value) for value in row.values() if isinstance(value, str))
+            if self.pending_rows >= self.flush_rows or self.pending_bytes >= self.flush_bytes:
+                self.flush()
+
+    def flush(self):
+        for repo_name, rows in self.buffers.items():
+            df = pd.DataFrame(rows, columns=self.columns)
+            if repo_name not in self.parts:
+                self.parts[repo_name] = self.part_path(repo_name)
+            if self.output_format == "parquet":
+                self.write_parquet(repo_name, df.drop(columns="repository"))
+            else:
+                part = self.parts[repo_name]
+                df.to_csv(part, mode="a", header=not os.path.exists(part), index=False)
+        self.buffers = {}
+        self.pending_rows = 0
+        self.pending_bytes = 0
+
+    def part_path(self, repo_name):
+        if self.output_format == "parquet":
+            directory = os.path.join(self.staging, partition_name(repo_name))
+            os.makedirs(directory)
+            return os.path.join(directory, "part-0.parquet")
+        return os.path.join(self.staging, quote(repo_name, safe="") + ".csv")
+
+    def write_parquet(self, repo_name, df):
+        if repo_name not in self.parquet_writers:
+            schema = pa.schema([(column, pa.string()) for column in df.columns])
+            self.parquet_writers[repo_name] = pq.ParquetWriter(
+                self.parts[repo_name], schema, compression="zstd")
+        writer = self.parquet_writers[repo_name]
+        table = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+        writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+
+    def sort_part(self, part, positions):
+        """Reorder a part by commit position unless it is already in order"""
+        parquet = self.output_format == "parquet"
+        if parquet:
+            shas = pq.read_table(part, columns=["commit_sha"]).column(0).to_pylist()
+        else:
+            shas = pd.read_csv(part, dtype=str, keep_default_na=False, usecols=["commit_sha"])["commit_sha"]
+        # Commits no longer in the history (rewritten upstream) go last
+        keys = [positions.get(sha, len(positions)) for sha in shas]
+        if all(a <= b for a, b in zip(keys, keys[1:])):
+            return
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        if parquet:
+            table = pq.read_table(part).take(order)
+            pq.write_table(table, part, row_group_size=ROW_GROUP_ROWS, compression="zstd")
+        else:
+            df = pd.read_csv(part, dtype=str, keep_default_na=False)
+            df.iloc[order].to_csv(part, index=False)
+
+    def close(self, positions=None):
+        """Finish the dataset and swap it in; positions(repo_name) gives {sha: history position}"""
+        self.flush()
+        for writer in self.parquet_writers.values():
+            writer.close()
+        self.parquet_writers = {}
+        if positions is not None:
+            for repo_name, part in self.parts.items():
+                self.sort_part(part, positions(repo_name))
+
+        if self.output_format == "parquet":
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.rename(self.staging, self.path)
+        else:
+            with open(self.path + ".tmp", "wb") as out:
+                for i, part in enumerate(self.parts.values()):
+                    with open(part, "rb") as f:
+                        # Keep only the first part's header line
+                        if i:
+                            f.readline()
+                        shutil.copyfileobj(f, out)
+            os.replace(self.path + ".tmp", self.path)
+            shutil.rmtree(self.staging)
+
+        self.skipped_file.close()
+        os.replace(self.skipped_path + ".tmp", self.skipped_path)
+        if self.results is not None:
+            self.results.close()
+        if self.cube is not None:
+            self.cube.save()
+
+    def abort(self):
+        """Drop everything staged, leaving the previous output untouched"""
+        for writer in self.parquet_writers.values():
+            writer.close()
+        self.skipped_file.close()
+        shutil.rmtree(self.staging, ignore_errors=True)
+        os.remove(self.skipped_path + ".tmp")
+        if self.results is not None:
+            self.results.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.abort()
+
+
+def dataset_mtime(path=DATASET_DIR, csv_path=DATASET_CSV):
+    """Modification time of the newest dataset output, or 0 if there is none"""
+    return max((os.path.getmtime(p) for p in (path, csv_path) if os.path.exists(p)), default=0)
+
+
+def read_dataset(columns=None, path=DATASET_DIR, csv_path=DATASET_CSV):
+    """Load the dataset, or only the given columns, from Parquet or else the CSV export
+
+    Parquet partitions come back in repository name order.
+    """
+    if pq is not None and os.path.isdir(path):
+        df = pq.read_table(path, columns=columns, partitioning="hive").to_pandas()
+        # The partition column is appended last; put columns back in row order
+        return df[columns or ["repository", *df.columns.drop("repository")]]
+    return pd.read_csv(csv_path, usecols=columns)
+
+
+def source_state(path):
+    """(name, mtime_ns, size) of a file, or of every file under a directory"""
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return ((path, stat.st_mtime_ns, stat.st_size),)
+    state = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            state.append((os.path.relpath(os.path.join(root, name), path), stat.st_mtime_ns, stat.st_size))
+    return tuple(state)
+
+
+def typed(df):
+    """CATEGORY_COLUMNS as categoricals and discrepancy as a boolean"""
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    if "discrepancy" in df:
+        df["discrepancy"] = df["discrepancy"] == "Yes"
+    return df
+
+
+def load_dataset(columns=None, path=DATASET_DIR, csv_path=DATASET_CSV, cache_dir=LOAD_CACHE_DIR):
+    """read_dataset with typed columns (see typed), memoized in cache_dir
+
+    The parsed frame is pickled under a name derived from the source, the
+    columns and the source's file sizes and modification times, so a
+    rewritten dataset is parsed again and an unchanged one never is.
+    cache_dir=None turns the cache off.
+    """
+    source = path if pq is not None and os.path.isdir(path) else csv_path
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    if cache_dir is None:
+        return typed(read_dataset(columns, path, csv_path))
+
+    selection = hashlib.sha1(repr((os.path.abspath(source), columns)).encode()).hexdigest()[:16]
+    state = hashlib.sha1(repr(source_state(source)).encode()).hexdigest()[:16]
+    cached = os.path.join(cache_dir, f"{selection}-{state}.pkl")
+    if os.path.exists(cached):
+        return pd.read_pickle(cached)
+
+    df = typed(read_dataset(columns, path, csv_path))
+    os.makedirs(cache_dir, exist_ok=True)
+    # Entries for older versions of the same source and columns are stale
+    for name in os.listdir(cache_dir):
+        if name.startswith(selection + "-"):
+            os.remove(os.path.join(cache_dir, name))
+    df.to_pickle(cached + ".tmp")
+    os.replace(cached + ".tmp", cached)
+    return df
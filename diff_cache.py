@@ -0,0 +1,214 @@
+"""
+Diff Cache
+Content-addressed on-disk store of diff bodies keyed by blob pair, algorithm and flags
+"""
+
+import sqlite3
+
+from native_diff import BINARY_BODY, render_patch
+
+CACHE_PATH = "diff_cache.sqlite"
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Options every cached diff was produced with; part of the key
+DIFF_FLAGS = "-w --ignore-blank-lines"
+
+# Writes are kept in memory and flushed in one short transaction once this
+# many are pending or their bodies reach FLUSH_BYTES, so parallel shards
+# sharing the file never wait on each other for long
+COMMIT_EVERY = 1000
+FLUSH_BYTES = 16 * 1024 ** 2
+
+
+class DiffCache:
+    """SQLite table of diff bodies with least-recently-used eviction
+
+    Bodies are stored without their headers (see native_diff.diff_body), so
+    one entry serves every path, commit and repository sharing the blob pair.
+    Recency is a logical clock bumped on each put and hit. New bodies and
+    recency updates are written in batches; after each, if the bodies
+    stored by every process sharing the file exceed max_bytes, the least
+    recently used are evicted down to nine tenths of it.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Parallel shards share the file, so wait on their locks instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS diffs (
+                old_id TEXT NOT NULL,
+                new_id TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                flags TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                used INTEGER NOT NULL,
+                PRIMARY KEY (old_id, new_id, algorithm, flags)
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS diffs_used ON diffs (used)")
+        # Lets the total size be summed without reading the bodies
+        self.conn.execute("CREATE INDEX IF NOT EXISTS diffs_size ON diffs (size)")
+        self.conn.commit()
+        self.size, self.clock = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) FROM diffs").fetchone()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Unwritten bodies and recency updates by key
+        self.puts = {}
+        self.used = {}
+        self.pending_bytes = 0
+
+    def tick(self):
+        self.clock += 1
+        return self.clock
+
+    def get(self, old_id, new_id, algorithm, flags=DIFF_FLAGS):
+        """Return the cached body for a blob pair, or None on a miss"""
+        key = (old_id, new_id, algorithm, flags)
+        if key in self.puts:
+            body = self.puts[key][0]
+            self.puts[key] = (body, self.tick())
+        else:
+            row = self.conn.execute(
+                "SELECT body FROM diffs WHERE old_id = ? AND new_id = ? AND algorithm = ? AND flags = ?",
+                key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body = row[0]
+            self.used[key] = self.tick()
+        self.hits += 1
+        self.pending()
+        return body
+
+    def put(self, old_id, new_id, algorithm, body, flags=DIFF_FLAGS):
+        key = (old_id, new_id, algorithm, flags)
+        self.used.pop(key, None)
+        self.puts[key] = (body, self.tick())
+        self.pending_bytes += len(body)
+        self.pending()
+
+    def pending(self):
+        if len(self.puts) + len(self.used) >= COMMIT_EVERY or self.pending_bytes >= FLUSH_BYTES:
+            self.flush()
+
+    def flush(self):
+        """Write pending bodies and recency updates in one transaction, then evict if over max_bytes"""
+        if self.puts or self.used:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO diffs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(*key, body, len(body), used) for key, (body, used) in self.puts.items()])
+                self.conn.executemany(
+                    "UPDATE diffs SET used = ? WHERE old_id = ? AND new_id = ? AND algorithm = ? AND flags = ?",
+                    [(used, *key) for key, used in self.used.items()])
+            self.puts = {}
+            self.used = {}
+            self.pending_bytes = 0
+        # Other processes write to the same file, so only its own total counts
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM diffs").fetchone()[0]
+        if self.size > self.max_bytes:
+            self.evict(self.max_bytes * 9 // 10)
+
+    def evict(self, target_bytes):
+        """Drop least recently used bodies until at most target_bytes remain"""
+        while self.size > target_bytes:
+            rows = self.conn.execute(
+                "SELECT old_id, new_id, algorithm, flags, size FROM diffs ORDER BY used LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            doomed = []
+            for *key, size in rows:
+                doomed.append(key)
+                self.size -= size
+                if self.size <= target_bytes:
+                    break
+            # Another process may have evicted some of them already
+            with self.conn:
+                deleted = self.conn.executemany(
+                    "DELETE FROM diffs WHERE old_id = ? AND new_id = ? AND algorithm = ? AND flags = ?",
+                    doomed).rowcount
+            self.evictions += deleted
+
+    def counters(self):
+        """What report() sums up, as plain values a worker process can return"""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def merge(self, counters):
+        """Add the counters() of a DiffCache in another process on the same file"""
+        self.hits += counters["hits"]
+        self.misses += counters["misses"]
+        self.evictions += counters["evictions"]
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"Diff cache: {self.hits:,} hits, {self.misses:,} misses ({rate:.1f}% hit rate), "
+                f"{self.evictions:,} evicted, {(self.size + self.pending_bytes) / 1024 ** 2:,.1f} MB in {self.path}")
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def patch_body(text):
+    """Strip the headers from a `git diff` patch, leaving what diff_body produces"""
+    # Hunk lines always start with ' ', '+', '-', '@' or '\\'
+    if "\nBinary files " in text:
+        return BINARY_BODY
+    start = text.find("\n--- ")
+    if start < 0:
+        return b""
+    # Skip the '---' and '+++' label lines
+    start = text.index("\n", text.index("\n", start + 1) + 1) + 1
+    return text[start:].encode("utf-8")
+
+
+class CachedDiffer:
+    """get_diff-compatible wrapper answering repeated blob pairs from a DiffCache
+
+    Changed paths are listed twice by the pool's `git diff-tree --raw`
+    workers: with full object names for the cache key and abbreviated ones
+    for rebuilding the patch header. Submodules, type changes, anything else
+    the listing cannot describe and paths the repository's attributes give
+    a diff driver, -diff or diff (see GitAttributeReader) go straight to
+    the wrapped backend: their patches depend on more than the blob pair.
+    """
+
+    def __init__(self, pool, cache, diff):
+        self.pool = pool
+        self.cache = cache
+        self.diff = diff
+
+    def get_diff(self, repo_dir, parent, child, path, algorithm):
+        if not parent or not path:
+            return None
+
+        changes = self.pool.tree_worker(repo_dir).get_file_diffs(parent, child)
+        full_changes = self.pool.tree_worker(repo_dir, full_ids=True).get_file_diffs(parent, child)
+        change = (changes or {}).get(path)
+        full_change = (full_changes or {}).get(path)
+        if (change is None or full_change is None or change.status not in ("A", "M", "D")
+                or "160000" in (change.old_mode, change.new_mode)
+                or self.pool.attribute_reader(repo_dir).git_diffs(path)):
+            return self.diff(repo_dir, parent, child, path, algorithm)
+
+        body = self.cache.get(full_change.old_id, full_change.new_id, algorithm)
+        if body is not None:
+            return render_patch(path, change, body)
+
+        text = self.diff(repo_dir, parent, child, path, algorithm)
+        if text is not None:
+            self.cache.put(full_change.old_id, full_change.new_id, algorithm, patch_body(text))
+        return text
@@ -0,0 +1,126 @@
+"""
+Diff Check
+Random edit scripts diffed by the native engine and by `git diff --no-index` under every algorithm and whitespace option
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+from native_diff import SUPPORTED_ALGORITHMS, VECTOR_MIN_RECORDS, DiffInput, diff_body
+from sweep import WHITESPACE_OPTIONS
+
+# Shapes of generated files: few distinct short lines with whitespace
+# variants, long files past VECTOR_MIN_RECORDS, files of mostly repeated
+# lines (histogram's fallback to Myers) and unrelated rewrites, kept short
+# since a minimal diff of two unrelated files is quadratic
+KINDS = ("small", "large", "repeated", "rewrite")
+
+SMALL_LINES = (b"x\n", b"y\n", b"z\n", b"\n", b"  \n", b"}\n", b"\treturn\n", b"foo()\n",
+               b"  foo()\n", b"def f():\n", b"    a = 1\n", b"    pass\n", b"\t\n")
+
+
+def random_lines(rng, kind):
+    """Pool of lines a file of this kind is drawn from, and its length"""
+    if kind == "small":
+        return list(SMALL_LINES), rng.randint(0, 40)
+    if kind == "large":
+        pool = [f"line {i}\n".encode() for i in range(rng.randint(20, 3000))] + [b"}\n", b"\n", b"{\n"] * 30
+        return pool, rng.randint(VECTOR_MIN_RECORDS, 4000)
+    if kind == "repeated":
+        pool = [b"}\n"] * 50 + [b"\n"] * 20 + [f"v{i}\n".encode() for i in range(30)]
+        return pool, rng.randint(50, 600)
+    pool = [f"w{i}\n".encode() for i in range(rng.randint(50, 2000))] + [b"\n", b"}\n"] * 5
+    return pool, rng.randint(200, 1200)
+
+
+def random_pair(rng, kind):
+    """An old file and a new one made from it by random deletions, insertions, moves and whitespace edits"""
+    pool, length = random_lines(rng, kind)
+    old = [rng.choice(pool) for _ in range(length)]
+    new = [rng.choice(pool) for _ in range(rng.randint(200, 1200))] if kind == "rewrite" else list(old)
+
+    for _ in range(rng.randint(1, 6 if kind == "small" else 30)):
+        at = rng.randint(0, len(new))
+        count = rng.randint(1, 40 if kind == "large" else 6)
+        edit = rng.random()
+        if edit < 0.3:
+            del new[at:at + count]
+        elif edit < 0.6:
+            new[at:at] = [rng.choice(pool) for _ in range(count)]
+        elif edit < 0.8 and len(new) > count:
+            block = new[at:at + count]
+            del new[at:at + count]
+            to = rng.randint(0, len(new))
+            new[to:to] = block
+        else:
+            new[at:at + count] = [line.replace(b"\n", b" \n") for line in new[at:at + count]]
+
+    old, new = b"".join(old), b"".join(new)
+    # Files without a final newline
+    if old and rng.random() < 0.2:
+        old = old[:-1]
+    if new and rng.random() < 0.2:
+        new = new[:-1]
+    return old, new
+
+
+def git_body(directory, algorithm, flags):
+    """Hunks of `git diff --no-index` between the files old and new in directory"""
+    result = subprocess.run(
+        ["git", "diff", "--no-index", "--no-color", "--no-ext-diff", *flags,
+         f"--diff-algorithm={algorithm}", "old", "new"],
+        cwd=directory,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    start = result.stdout.find(b"\n@@")
+    return result.stdout[start + 1:] if start >= 0 else b""
+
+
+def check(cases, seed=0, keep=None):
+    """Diff cases random file pairs under every variant; returns the mismatches as (case, kind, variant)"""
+    rng = random.Random(seed)
+    mismatches = []
+    with tempfile.TemporaryDirectory() as directory:
+        for case in range(cases):
+            kind = KINDS[case % len(KINDS)]
+            old, new = random_pair(rng, kind)
+            for name, data in (("old", old), ("new", new)):
+                with open(os.path.join(directory, name), "wb") as f:
+                    f.write(data)
+
+            for option, (ignore_space, ignore_blank_lines, flags) in WHITESPACE_OPTIONS.items():
+                inp = DiffInput(old, new, ignore_space=ignore_space, ignore_blank_lines=ignore_blank_lines)
+                for algorithm in SUPPORTED_ALGORITHMS:
+                    if diff_body(inp, algorithm) == git_body(directory, algorithm, flags):
+                        continue
+                    variant = f"{algorithm}/{option}"
+                    mismatches.append((case, kind, variant))
+                    print(f"Mismatch: case {case} ({kind}), {variant}")
+                    if keep is not None:
+                        os.makedirs(keep, exist_ok=True)
+                        for name, data in (("old", old), ("new", new)):
+                            with open(os.path.join(keep, f"{case}.{name}"), "wb") as f:
+                                f.write(data)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the native diff engine against git on random edits")
+    parser.add_argument("--cases", type=int, default=100, help="file pairs to generate (default 100)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default 0)")
+    parser.add_argument("--keep", help="directory to save the file pairs that mismatch")
+    args = parser.parse_args()
+
+    variants = len(SUPPORTED_ALGORITHMS) * len(WHITESPACE_OPTIONS)
+    mismatches = check(args.cases, args.seed, args.keep)
+    print(f"{args.cases:,} file pairs x {variants} variants: {len(mismatches):,} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Diff Store
+Compressed, content-addressed side store for the diff text of dataset rows
+"""
+
+import hashlib
+import sqlite3
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+STORE_PATH = "diff_store.sqlite"
+
+# Bodies collected before a zstd dictionary is trained on them, and its
+# size in bytes; 0 disables training
+TRAIN_SAMPLES = 2000
+DICTIONARY_BYTES = 112 * 1024
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+
+# Row columns whose text moves to the store, and the digest columns replacing them
+DIFF_COLUMNS = {"diff_myers": "diff_myers_digest", "diff_histogram": "diff_histogram_digest"}
+
+
+def digest(text):
+    """Content address of a diff: SHA-256 of its UTF-8 text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DiffStore:
+    """SQLite table of compressed diff bodies keyed by digest
+
+    Each distinct text is stored once, however many rows and algorithms
+    share it. Bodies are zstd-compressed when zstandard is installed and
+    zlib-compressed otherwise. With zstd, once TRAIN_SAMPLES bodies have
+    been stored a dictionary is trained on them and used for every later
+    body; each body records the dictionary it needs, so bodies from before
+    training, or from other runs, stay readable.
+    """
+
+    def __init__(self, path=STORE_PATH, train_samples=TRAIN_SAMPLES, dictionary_bytes=DICTIONARY_BYTES):
+        self.path = path
+        self.train_samples = train_samples if zstandard is not None and dictionary_bytes else 0
+        self.dictionary_bytes = dictionary_bytes
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS bodies (
+                digest TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                dictionary INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                body BLOB NOT NULL
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dictionaries (
+                id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL
+            )""")
+        self.samples = []
+        self.dictionary = 0
+        self.compressors = {}
+        self.decompressors = {}
+        row = self.conn.execute("SELECT MAX(id) FROM dictionaries").fetchone()
+        if row[0] is not None:
+            self.dictionary = row[0]
+            self.train_samples = 0
+        self.puts = 0
+        self.stored = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def _zstd_dictionary(self, dictionary):
+        data = self.conn.execute("SELECT data FROM dictionaries WHERE id = ?", (dictionary,)).fetchone()[0]
+        return zstandard.ZstdCompressionDict(data)
+
+    def compress(self, data):
+        """(codec, dictionary id, compressed bytes) for a new body"""
+        if zstandard is None:
+            return "zlib", 0, zlib.compress(data, ZLIB_LEVEL)
+        if self.dictionary not in self.compressors:
+            if self.dictionary:
+                self.compressors[self.dictionary] = zstandard.ZstdCompressor(
+                    level=ZSTD_LEVEL, dict_data=self._zstd_dictionary(self.dictionary))
+            else:
+                self.compressors[0] = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return "zstd", self.dictionary, self.compressors[self.dictionary].compress(data)
+
+    def decompress(self, codec, dictionary, body):
+        if codec == "zlib":
+            return zlib.decompress(body)
+        if zstandard is None:
+            raise RuntimeError(f"{self.path} holds zstd bodies; install zstandard to read them")
+        if dictionary not in self.decompressors:
+            if dictionary:
+                self.decompressors[dictionary] = zstandard.ZstdDecompressor(
+                    dict_data=self._zstd_dictionary(dictionary))
+            else:
+                self.decompressors[0] = zstandard.ZstdDecompressor()
+        return self.decompressors[dictionary].decompress(body)
+
+    def put(self, text):
+        """Store a diff unless it is already there; returns its digest"""
+        key = digest(text)
+        self.puts += 1
+        if self.conn.execute("SELECT 1 FROM bodies WHERE digest = ?", (key,)).fetchone():
+            return key
+
+        data = text.encode("utf-8")
+        codec, dictionary, body = self.compress(data)
+        self.conn.execute("INSERT INTO bodies VALUES (?, ?, ?, ?, ?)",
+                          (key, codec, dictionary, len(data), body))
+        self.stored += 1
+        self.raw_bytes += len(data)
+        self.stored_bytes += len(body)
+
+        if self.train_samples and data:
+            self.samples.append(data)
+            if len(self.samples) >= self.train_samples:
+                self.train()
+        return key
+
+    def train(self):
+        """Train a zstd dictionary on the bodies sampled so far and use it from now on"""
+        try:
+            trained = zstandard.train_dictionary(self.dictionary_bytes, self.samples)
+        except zstandard.ZstdError:
+            # Too little or too uniform material; keep compressing without one
+            self.samples = []
+            self.train_samples = 0
+            return
+        self.dictionary = self.conn.execute(
+            "INSERT INTO dictionaries (data) VALUES (?)", (trained.as_bytes(),)).lastrowid
+        self.samples = []
+        self.train_samples = 0
+
+    def get(self, key):
+        """The diff text stored under a digest, or None if there is none"""
+        row = self.conn.execute(
+            "SELECT codec, dictionary, body FROM bodies WHERE digest = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return self.decompress(*row).decode("utf-8")
+
+    def digest_row(self, row):
+        """Copy of a row with its diff text stored and replaced by digests
+
+        Skipped files have no diff and get empty digests.
+        """
+        out = {}
+        for column, value in row.items():
+            if column in DIFF_COLUMNS:
+                out[DIFF_COLUMNS[column]] = "" if row.get("skip_reason") else self.put(value)
+            else:
+                out[column] = value
+        return out
+
+    def commit(self):
+        self.conn.commit()
+
+    def report(self):
+        ratio = self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0
+        return (f"Diff store: {self.puts:,} diffs, {self.stored:,} new bodies, "
+                f"{self.raw_bytes / 1024 ** 2:,.1f} MB compressed {ratio:.1f}x into {self.path}")
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DigestRows:
+    """Sink wrapper that moves each row's diff text into a DiffStore before the sink sees it
+
+    The store is committed before rows are handed on, so a checkpoint never
+    records a digest whose body was lost to a crash.
+    """
+
+    def __init__(self, sink, store):
+        self.sink = sink
+        self.store = store
+
+    def seen(self, repo_name):
+        return self.sink.seen(repo_name)
+
+    def add(self, repo_name, sha, rows):
+        rows = [self.store.digest_row(row) for row in rows]
+        self.store.commit()
+        self.sink.add(repo_name, sha, rows)
+
+    def load_rows(self, columns=None):
+        return self.sink.load_rows(columns)
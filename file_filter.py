@@ -0,0 +1,193 @@
+"""
+File Filter
+Decides before diffing which changed files are skipped, and why, or sent to the slow queue
+"""
+
+import re
+import subprocess
+from collections import Counter
+
+from native_diff import is_binary
+from stream_compare import StreamComparer
+
+# Lockfiles, minified bundles and vendored trees: huge or meaningless diffs
+SKIP_GLOBS = (
+    "*.min.js", "*.min.css", "*.map",
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock",
+    "uv.lock", "Cargo.lock", "composer.lock", "go.sum",
+    "**/node_modules/**", "**/vendor/**", "**/third_party/**",
+)
+
+# Files with a side larger than MAX_FILE_BYTES are skipped; larger than
+# SLOW_FILE_BYTES they are diffed by git in the slow queue, which gives each
+# diff FILE_TIME_BUDGET seconds
+MAX_FILE_BYTES = 4 * 1024 ** 2
+SLOW_FILE_BYTES = 256 * 1024
+FILE_TIME_BUDGET = 30
+
+SLOW = "slow"
+TIMEOUT = "timeout"
+
+
+def glob_regex(pattern):
+    """Compile a gitattributes-style glob: * and ? stop at '/', ** crosses directories"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("/.*")
+            i += 3
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(out) + r"\Z")
+
+
+def compile_pattern(pattern):
+    """(regex, basename_only) for a glob; patterns without a '/' match the file name at any depth"""
+    basename_only = "/" not in pattern
+    return glob_regex(pattern.lstrip("/")), basename_only
+
+
+def pattern_matches(compiled, path):
+    regex, basename_only = compiled
+    return regex.match(path.rsplit("/", 1)[-1] if basename_only else path) is not None
+
+
+def is_set(value):
+    return value is True or value == "true"
+
+
+class FileFilter:
+    """Reasons to skip a changed file, taken from its path, attributes and blobs
+
+    check() returns None for files to diff right away, SLOW for files to
+    leave to the slow queue, or why the file is skipped: "glob", "generated"
+    or "vendored" (linguist attributes), "no-diff" (-diff or binary
+    attributes), "oversized" or "binary". Attributes are the ones git
+    applies in the repository (see GitAttributeReader), and blob sizes and
+    contents come from the pool's cat-file workers.
+
+    Given the native backend's LineCache as lines, files small enough to be
+    diffed in-process are read through it, under the same keys, so the
+    binary check does not read them a second time.
+    """
+
+    def __init__(self, pool, globs=SKIP_GLOBS, max_bytes=MAX_FILE_BYTES,
+                 slow_bytes=SLOW_FILE_BYTES, time_budget=FILE_TIME_BUDGET, lines=None):
+        self.pool = pool
+        self.lines = lines
+        self.globs = [compile_pattern(glob) for glob in globs]
+        self.max_bytes = max_bytes
+        self.slow_bytes = slow_bytes
+        self.time_budget = time_budget
+        self.reasons = Counter()
+        self.comparer = StreamComparer(timeout=time_budget)
+
+    def check(self, repo_dir, parent, child, path):
+        reason = self._reason(repo_dir, parent, child, path)
+        if reason is not None:
+            self.reasons[reason] += 1
+        return reason
+
+    def _reason(self, repo_dir, parent, child, path):
+        if any(pattern_matches(glob, path) for glob in self.globs):
+            return "glob"
+
+        attributes = self.pool.attribute_reader(repo_dir).read(path)
+        if is_set(attributes.get("linguist-generated")):
+            return "generated"
+        if is_set(attributes.get("linguist-vendored")):
+            return "vendored"
+        if attributes.get("diff") is False:
+            return "no-diff"
+
+        changes = self.pool.tree_worker(repo_dir).get_file_diffs(parent, child)
+        change = (changes or {}).get(path)
+        if change is None or "160000" in (change.old_mode, change.new_mode):
+            return None
+
+        sizer = self.pool.blob_sizer(repo_dir)
+        sizes = [sizer.read(change.old_id), sizer.read(change.new_id)]
+        if None in sizes:
+            return None
+        if max(sizes) > self.max_bytes:
+            return "oversized"
+
+        # A set diff attribute makes git diff the file as text whatever it holds
+        if attributes.get("diff") is not True and any(
+                is_binary(data) for data in self.contents(repo_dir, change, max(sizes) <= self.slow_bytes)):
+            return "binary"
+        if max(sizes) > self.slow_bytes:
+            return SLOW
+        return None
+
+    def contents(self, repo_dir, change, cached):
+        """Both blobs of a change, through the line cache when cached and there is one"""
+        reader = self.pool.blob_reader(repo_dir)
+        if not cached or self.lines is None:
+            return [reader.read(object_id) or b"" for object_id in (change.old_id, change.new_id)]
+
+        # Keyed like NativeDiffer.read_input: abbreviated ids within a repository
+        def read(key):
+            return reader.read(key[1])
+
+        blobs = [self.lines.get((repo_dir, object_id), read) for object_id in (change.old_id, change.new_id)]
+        return [blob.data if blob is not None else b"" for blob in blobs]
+
+    def budget_diff(self, repo_dir, parent, child, path, algorithm):
+        """get_diff for the slow queue: raises subprocess.TimeoutExpired past the time budget"""
+        try:
+            result = subprocess.run(
+                ["git", "diff", "-w", "--ignore-blank-lines", f"--diff-algorithm={algorithm}",
+                 parent, child, "--", path],
+                cwd=repo_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=self.time_budget
+            )
+        except subprocess.TimeoutExpired:
+            self.reasons[TIMEOUT] += 1
+            raise
+        if result.returncode:
+            return None
+        return result.stdout.decode("utf-8", errors="replace")
+
+    def budget_compare(self, repo_dir, parent, child, path):
+        """StreamComparer.compare for the slow queue: raises subprocess.TimeoutExpired past the time budget"""
+        try:
+            return self.comparer.compare(repo_dir, parent, child, path)
+        except subprocess.TimeoutExpired:
+            self.reasons[TIMEOUT] += 1
+            raise
+
+    def counters(self):
+        """What report() sums up, as plain values a worker process can return"""
+        return {"reasons": self.reasons}
+
+    def merge(self, counters):
+        """Add the counters() of a FileFilter in another process"""
+        self.reasons.update(counters["reasons"])
+
+    def report(self):
+        skipped = sum(count for reason, count in self.reasons.items() if reason not in (SLOW, TIMEOUT))
+        reasons = ", ".join(f"{count:,} {reason}" for reason, count in self.reasons.most_common()
+                            if reason not in (SLOW, TIMEOUT))
+        return (f"File filter: {skipped:,} files skipped ({reasons or 'none'}), "
+                f"{self.reasons[SLOW]:,} sent to the slow queue, {self.reasons[TIMEOUT]:,} over the time budget")
@@ -0,0 +1,522 @@
+"""
+Git Worker Pool
+Long-lived git diff-tree helpers that answer diff requests over pipes
+"""
+
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+# Echoed back by `git diff-tree --stdin` once a request has been answered.
+# Lines that are not object names are copied to stdout verbatim, and no
+# patch line can start with '#', so this marks the end of each response.
+SENTINEL = b"#diff-tree-done"
+
+NULL_ID_CHAR = "0"
+
+# Attributes the attribute reader resolves: how git diffs a path, and the
+# linguist markers the file filter skips on
+CHECKED_ATTRIBUTES = ("diff", "linguist-generated", "linguist-vendored")
+
+# One entry of `git diff-tree --raw` output
+TreeChange = namedtuple("TreeChange", "old_mode new_mode old_id new_id status")
+
+
+def parse_diff_header_path(line):
+    """Extract the path from a 'diff --git a/<path> b/<path>' header line"""
+    rest = line[len("diff --git "):].rstrip("\n")
+    if rest.startswith('"'):
+        return unquote_c_style(rest)[2:]
+    # Without rename detection both sides carry the same path
+    return rest[2:(len(rest) - 1) // 2]
+
+
+def unquote_c_style(text):
+    """Decode the leading C-quoted token git emits for unusual path names"""
+    escapes = {"a": 7, "b": 8, "f": 12, "n": 10, "r": 13, "t": 9, "v": 11,
+               '"': 34, "\\": 92}
+    out = bytearray()
+    i = 1
+    while i < len(text) and text[i] != '"':
+        ch = text[i]
+        if ch != "\\":
+            out += ch.encode("utf-8")
+            i += 1
+        elif text[i + 1] in escapes:
+            out.append(escapes[text[i + 1]])
+            i += 2
+        else:
+            out.append(int(text[i + 1:i + 4], 8))
+            i += 4
+    return out.decode("utf-8", errors="replace")
+
+
+def quote_path(prefix, path):
+    """Quote prefix + path the way git prints it in patch headers (core.quotepath on)"""
+    raw = (prefix + path).encode("utf-8", errors="surrogateescape")
+    escapes = {7: "a", 8: "b", 9: "t", 10: "n", 11: "v", 12: "f", 13: "r",
+               34: '"', 92: "\\"}
+    if not any(b < 0x20 or b >= 0x7f or b in (34, 92) for b in raw):
+        return prefix + path
+    out = ['"']
+    for b in raw:
+        if b in escapes:
+            out.append("\\" + escapes[b])
+        elif b < 0x20 or b >= 0x7f:
+            out.append(f"\\{b:03o}")
+        else:
+            out.append(chr(b))
+    out.append('"')
+    return "".join(out)
+
+
+def is_null_id(object_id):
+    """True for the all-zero id/mode git prints for a missing side"""
+    return object_id.strip(NULL_ID_CHAR) == ""
+
+
+def parse_raw_line(line):
+    """Parse one `--raw` line (bytes) into (path, TreeChange), or None for other lines"""
+    meta, _, path = line.decode("utf-8", errors="replace").rstrip("\n").partition("\t")
+    if not meta.startswith(":"):
+        return None
+    if path.startswith('"'):
+        path = unquote_c_style(path)
+    return path, TreeChange(*meta[1:].split())
+
+
+def iter_file_patches(lines):
+    """Yield (path, patch text) per file while reading patch lines (bytes)
+
+    Each file is emitted as soon as the next file header arrives, so a
+    whole-commit diff is never held in memory as one buffer.
+    """
+    path = None
+    chunk = []
+    for line in lines:
+        if line.startswith(b"diff --git "):
+            if path is not None:
+                yield path, b"".join(chunk).decode("utf-8", errors="replace")
+            path = parse_diff_header_path(line.decode("utf-8", errors="replace"))
+            chunk = []
+        chunk.append(line)
+    if path is not None:
+        yield path, b"".join(chunk).decode("utf-8", errors="replace")
+
+
+def get_commit_diffs(repo_dir, parent, child, algorithm):
+    """Get {path: patch} for every file of a commit from a single git diff"""
+    if not parent:
+        return None
+
+    # Rename detection would pair files that per-path diffs keep apart
+    cmd = [
+        "git", "diff",
+        "-w",
+        "--ignore-blank-lines",
+        "--no-renames",
+        f"--diff-algorithm={algorithm}",
+        parent,
+        child
+    ]
+    process = subprocess.Popen(
+        cmd,
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    with process:
+        files = dict(iter_file_patches(process.stdout))
+    if process.returncode:
+        return None
+    return files
+
+
+class GitDiffWorker:
+    """A single `git diff-tree --stdin` process bound to one repository and algorithm"""
+
+    def __init__(self, repo_dir, algorithm):
+        self.repo_dir = repo_dir
+        self.algorithm = algorithm
+        self.process = None
+        self.requests = 0
+        self._last_pair = None
+        self._last_files = {}
+
+    def command(self):
+        return [
+            "git", "diff-tree",
+            "--stdin",
+            "--no-commit-id",
+            "-r", "-p",
+            "-w",
+            "--ignore-blank-lines",
+            f"--diff-algorithm={self.algorithm}",
+        ]
+
+    def parse(self, lines):
+        return dict(iter_file_patches(lines))
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command(),
+            cwd=self.repo_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    def send(self, parent, child):
+        """Queue a diff request for a commit pair; False if git cannot be reached"""
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        try:
+            self.process.stdin.write(f"{child} {parent}\n".encode() + SENTINEL + b"\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            return False
+        return True
+
+    def read_lines(self):
+        """Yield response lines up to the sentinel, closing the worker if git exits"""
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                # git exited, typically on an unknown revision
+                self.close()
+                return
+            if line.rstrip(b"\n") == SENTINEL:
+                return
+            yield line
+
+    def get_file_diffs(self, parent, child):
+        """Return the parsed answer for a commit pair, reusing the last one"""
+        if self._last_pair != (parent, child):
+            if not self.send(parent, child):
+                return None
+            files = self.parse(self.read_lines())
+            if self.process is None:
+                return None
+            self.requests += 1
+            self._last_pair = (parent, child)
+            self._last_files = files
+        return self._last_files
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self._last_pair = None
+        self._last_files = {}
+
+
+class GitTreeWorker(GitDiffWorker):
+    """A `git diff-tree --stdin --raw` process listing changed blobs without patch text
+
+    Object names are abbreviated as in patch `index` lines unless full_ids is set.
+    """
+
+    def __init__(self, repo_dir, full_ids=False):
+        super().__init__(repo_dir, None)
+        self.full_ids = full_ids
+
+    def command(self):
+        cmd = ["git", "diff-tree", "--stdin", "--no-commit-id", "-r", "--raw"]
+        return cmd if self.full_ids else cmd + ["--abbrev"]
+
+    def parse(self, lines):
+        return dict(filter(None, map(parse_raw_line, lines)))
+
+
+class GitBlobReader:
+    """A `git cat-file --batch` process returning blob contents by object name"""
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.process = None
+        self.requests = 0
+
+    def command(self):
+        return ["git", "cat-file", "--batch"]
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command(),
+            cwd=self.repo_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    def read(self, object_id):
+        """Return the contents of an object as bytes, or None if it is missing"""
+        if is_null_id(object_id):
+            return b""
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        try:
+            self.process.stdin.write(object_id.encode() + b"\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            return None
+
+        header = self.process.stdout.readline()
+        if not header or header.endswith(b" missing\n") or header.endswith(b" ambiguous\n"):
+            return None
+        size = int(header.split()[2])
+        data = self.process.stdout.read(size)
+        self.process.stdout.read(1)
+        self.requests += 1
+        return data
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        self.process = None
+
+
+class GitBlobSizer(GitBlobReader):
+    """A `git cat-file --batch-check` process returning object sizes without their contents"""
+
+    def command(self):
+        return ["git", "cat-file", "--batch-check"]
+
+    def read(self, object_id):
+        """Return the size of an object in bytes, or None if it is missing"""
+        if is_null_id(object_id):
+            return 0
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        try:
+            self.process.stdin.write(object_id.encode() + b"\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            return None
+
+        header = self.process.stdout.readline()
+        if not header or header.endswith(b" missing\n") or header.endswith(b" ambiguous\n"):
+            return None
+        self.requests += 1
+        return int(header.split()[2])
+
+
+class GitAttributeReader(GitBlobReader):
+    """A `git check-attr --stdin -z` process returning the attributes git applies to a path
+
+    Run in the repository, it resolves them the way `git diff` there does:
+    from the working tree's .gitattributes files, $GIT_DIR/info/attributes
+    and core.attributesFile, with git's own precedence. Values are True
+    (set), False (unset) or a string; unspecified attributes are left out.
+    Answers are kept per path, since the files do not change during a run.
+    """
+
+    def __init__(self, repo_dir, attributes=CHECKED_ATTRIBUTES):
+        super().__init__(repo_dir)
+        self.attributes = tuple(attributes)
+        self.known = {}
+
+    def command(self):
+        return ["git", "check-attr", "--stdin", "-z", *self.attributes]
+
+    def read(self, path):
+        """Return {attribute: value} for a path, or {} if git cannot be asked"""
+        if path in self.known:
+            return self.known[path]
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        try:
+            self.process.stdin.write(path.encode("utf-8", errors="surrogateescape") + b"\0")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            return {}
+
+        # path NUL attribute NUL value NUL for each attribute asked about
+        fields = []
+        pending = b""
+        while len(fields) < 3 * len(self.attributes):
+            chunk = self.process.stdout.read1(1 << 16)
+            if not chunk:
+                self.close()
+                return {}
+            *done, pending = (pending + chunk).split(b"\0")
+            fields.extend(done)
+
+        values = {}
+        for i in range(0, len(fields), 3):
+            name, value = fields[i + 1].decode(), fields[i + 2].decode("utf-8", errors="replace")
+            if value != "unspecified":
+                values[name] = {"set": True, "unset": False}.get(value, value)
+        self.requests += 1
+        self.known[path] = values
+        return values
+
+    def git_diffs(self, path):
+        """Whether git diffs path its own way: with a diff driver, as binary (-diff) or as text (diff)
+
+        The in-process backends know neither drivers' hunk headers nor
+        forced text or binary, so these paths are left to git.
+        """
+        return "diff" in self.read(path)
+
+
+class CommitDiffer:
+    """get_diff-compatible front end running one `git diff` per commit and algorithm"""
+
+    def __init__(self):
+        self._last = {}
+
+    def get_diff(self, repo_dir, parent, child, path, algorithm):
+        if not parent or not path:
+            return None
+
+        key = (repo_dir, parent, child)
+        cached = self._last.get(algorithm)
+        if cached is None or cached[0] != key:
+            cached = (key, get_commit_diffs(repo_dir, parent, child, algorithm))
+            self._last[algorithm] = cached
+
+        files = cached[1]
+        if files is None:
+            return None
+        return files.get(path, "")
+
+
+class GitDiffPool:
+    """Lazily started workers, one per (repository, algorithm)"""
+
+    def __init__(self):
+        self.workers = {}
+
+    def worker(self, repo_dir, algorithm):
+        key = (repo_dir, algorithm)
+        if key not in self.workers:
+            self.workers[key] = GitDiffWorker(repo_dir, algorithm)
+        return self.workers[key]
+
+    def tree_worker(self, repo_dir, full_ids=False):
+        key = (repo_dir, "--raw", full_ids)
+        if key not in self.workers:
+            self.workers[key] = GitTreeWorker(repo_dir, full_ids)
+        return self.workers[key]
+
+    def blob_reader(self, repo_dir):
+        key = (repo_dir, "--batch")
+        if key not in self.workers:
+            self.workers[key] = GitBlobReader(repo_dir)
+        return self.workers[key]
+
+    def attribute_reader(self, repo_dir):
+        key = (repo_dir, "check-attr")
+        if key not in self.workers:
+            self.workers[key] = GitAttributeReader(repo_dir)
+        return self.workers[key]
+
+    def blob_sizer(self, repo_dir):
+        key = (repo_dir, "--batch-check")
+        if key not in self.workers:
+            self.workers[key] = GitBlobSizer(repo_dir)
+        return self.workers[key]
+
+    def get_diff(self, repo_dir, parent, child, path, algorithm):
+        """Drop-in replacement for simple_analysis.get_diff served by a persistent worker"""
+        if not parent or not path:
+            return None
+
+        files = self.worker(repo_dir, algorithm).get_file_diffs(parent, child)
+        if files is None:
+            return None
+        # Files whose changes vanish under -w / --ignore-blank-lines produce no output
+        return files.get(path, "")
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+        self.workers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def list_file_changes(repo_dir, max_commits):
+    """List (parent, child, path) triples for the newest non-merge commits"""
+    out = subprocess.check_output(
+        ["git", "-c", "core.quotepath=false", "log", "--no-merges",
+         f"--max-count={max_commits}", "--format=%x00%H %P", "--name-only"],
+        cwd=repo_dir
+    ).decode("utf-8", errors="replace")
+
+    work = []
+    for record in out.split("\0")[1:]:
+        header, _, names = record.partition("\n")
+        shas = header.split()
+        if len(shas) < 2:
+            continue
+        for path in names.splitlines():
+            if path:
+                work.append((shas[1], shas[0], path))
+    return work
+
+
+def _time_backend(diff, repo_dir, work):
+    start = time.perf_counter()
+    results = [
+        (diff(repo_dir, parent, child, path, "myers"),
+         diff(repo_dir, parent, child, path, "histogram"))
+        for parent, child, path in work
+    ]
+    return time.perf_counter() - start, results
+
+
+def benchmark(repo_dir, max_commits=200):
+    """Compare subprocess-per-call get_diff against the batched backends on one repository"""
+    from simple_analysis import get_diff
+    from native_diff import NativeDiffer
+
+    work = list_file_changes(repo_dir, max_commits)
+    calls = 2 * len(work)
+    print(f"Benchmarking {len(work):,} file diffs x 2 algorithms in {repo_dir}")
+
+    baseline_time, baseline = _time_backend(get_diff, repo_dir, work)
+    print(f"  {'subprocess per call':<20} {baseline_time:8.2f}s ({calls / baseline_time:,.0f} diffs/s)")
+
+    with GitDiffPool() as pool:
+        backends = [
+            ("whole-commit diff", CommitDiffer().get_diff),
+            ("worker pool", pool.get_diff),
+            ("native", NativeDiffer(pool).get_diff),
+        ]
+        for name, diff in backends:
+            elapsed, results = _time_backend(diff, repo_dir, work)
+            mismatches = sum(1 for a, b in zip(baseline, results) if a != b)
+            print(f"  {name:<20} {elapsed:8.2f}s ({calls / elapsed:,.0f} diffs/s), "
+                  f"{baseline_time / elapsed:.1f}x, mismatching files: {mismatches}")
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else ".")
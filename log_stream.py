@@ -0,0 +1,136 @@
+"""
+Log Stream Ingestion
+Whole-history collection from one `git log -p` stream per diff algorithm
+"""
+
+import subprocess
+from collections import namedtuple
+
+from git_pool import is_null_id, iter_file_patches, parse_raw_line
+
+# Commits are framed by NUL bytes, which cannot appear in text patches
+LOG_FORMAT = "--format=%x00%H %P%n%B%x00"
+MESSAGE_END = b"\x00\n"
+
+LogCommit = namedtuple("LogCommit", "sha parents message changes patches")
+
+
+def parse_log_commit(lines):
+    """Build a LogCommit from the lines of one commit in a `git log --raw -p` stream"""
+    shas = lines[0][1:].decode().split()
+    # The closing NUL shares a line with the message if it lacks a final newline
+    end = 1
+    while not lines[end].endswith(MESSAGE_END):
+        end += 1
+    message = b"".join(lines[1:end + 1])[:-len(MESSAGE_END)].decode("utf-8", errors="replace")
+
+    changes = {}
+    patch_start = len(lines)
+    for i in range(end + 1, len(lines)):
+        line = lines[i]
+        if line.startswith(b"diff --git "):
+            patch_start = i
+            break
+        parsed = parse_raw_line(line)
+        if parsed:
+            changes[parsed[0]] = parsed[1]
+
+    patches = dict(iter_file_patches(lines[patch_start:]))
+    return LogCommit(shas[0], shas[1:], message, changes, patches)
+
+
+def iter_log_commits(repo_dir, algorithm, revisions=("HEAD",)):
+    """Yield one LogCommit at a time, oldest first, while git log is still running
+
+    revisions may end with "--" and paths; those only select commits, every
+    file of a selected commit is still shown (--full-diff).
+    """
+    cmd = [
+        "git", "log",
+        "--reverse",
+        "--full-diff",
+        "--no-renames",
+        "--raw", "-p",
+        "-w",
+        "--ignore-blank-lines",
+        f"--diff-algorithm={algorithm}",
+        LOG_FORMAT,
+        *revisions
+    ]
+    process = subprocess.Popen(
+        cmd,
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    with process:
+        lines = []
+        for line in process.stdout:
+            if line.startswith(b"\x00") and line != MESSAGE_END and lines:
+                yield parse_log_commit(lines)
+                lines = []
+            lines.append(line)
+        if lines:
+            yield parse_log_commit(lines)
+
+
+def iter_log_pairs(repo_dir, max_commits=None, revisions=("HEAD",)):
+    """Zip the myers and histogram streams of a repository commit by commit
+
+    Only one commit per stream is held in memory at a time, however long the
+    history is. Stopping early (max_commits or closing the generator) also
+    stops both git processes.
+    """
+    myers = iter_log_commits(repo_dir, "myers", revisions)
+    histogram = iter_log_commits(repo_dir, "histogram", revisions)
+    try:
+        for count, (commit_myers, commit_histogram) in enumerate(zip(myers, histogram)):
+            if max_commits is not None and count >= max_commits:
+                break
+            if commit_myers.sha != commit_histogram.sha:
+                raise RuntimeError(f"git log streams diverged at {commit_myers.sha}")
+            yield commit_myers, commit_histogram
+    finally:
+        myers.close()
+        histogram.close()
+
+
+def count_commits(repo_dir, revisions=("HEAD",), max_commits=None):
+    limit = [] if max_commits is None else [f"--max-count={max_commits}"]
+    out = subprocess.check_output(["git", "rev-list", "--count", *limit, *revisions], cwd=repo_dir)
+    return int(out)
+
+
+def iter_commits(repo_dir, max_commits=None, revisions=("HEAD",)):
+    """Yield commit shas oldest first, in the order pydriller traverses them
+
+    Only shas cross the pipe, and git is stopped as soon as max_commits have
+    been read. rev-list applies --max-count before --reverse, which would
+    keep the newest commits, so the limit is applied here instead.
+    """
+    process = subprocess.Popen(
+        ["git", "rev-list", "--reverse", *revisions],
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        for count, line in enumerate(process.stdout):
+            if max_commits is not None and count >= max_commits:
+                break
+            yield line.decode().strip()
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+
+
+def list_commits(repo_dir, max_commits=None, revisions=("HEAD",)):
+    return list(iter_commits(repo_dir, max_commits, revisions))
+
+
+def change_paths(path, change):
+    """(old_path, new_path) as pydriller reports them for one raw change"""
+    old_path = None if is_null_id(change.old_mode) else path
+    new_path = None if is_null_id(change.new_mode) else path
+    return old_path, new_path
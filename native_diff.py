@@ -0,0 +1,1398 @@
+"""
+Native Diff Engine
+In-process Myers, patience and histogram diffs reproducing `git diff -w --ignore-blank-lines` and its whitespace variants
+"""
+
+import random
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from git_pool import is_null_id, quote_path
+
+# Whitespace as seen by git's ctype table (\v and \f are not spaces there)
+WHITESPACE = b" \t\n\r"
+CONTEXT_LINES = 3
+FUNC_LINE_MAX = 80
+FIRST_FEW_BYTES = 8000
+LINE_MAX = 2 ** 63 - 1
+
+# xdiff tuning constants (xdiff/xdiffi.c, xdiff/xprepare.c)
+MAX_EQLIMIT = 1024
+SIMSCAN_WINDOW = 100
+KPDIS_RUN = 4
+MAX_COST_MIN = 256
+HEUR_MIN_COST = 256
+SNAKE_CNT = 20
+K_HEUR = 4
+HISTOGRAM_MAX_CHAIN = 64
+
+# Myers inputs of at least VECTOR_MIN_RECORDS records (both sides together)
+# are trimmed and cleaned up (xdl_trim_ends, xdl_cleanup_records) with
+# NumPy over arrays of class ids; below that the Python loops are cheaper
+VECTOR_MIN_RECORDS = 500
+
+# Indent heuristic weights (xdiff/xdiffi.c)
+MAX_INDENT = 200
+MAX_BLANKS = 20
+INDENT_HEURISTIC_MAX_SLIDING = 100
+START_OF_FILE_PENALTY = 1
+END_OF_FILE_PENALTY = 21
+TOTAL_BLANK_WEIGHT = -30
+POST_BLANK_WEIGHT = 6
+RELATIVE_INDENT_PENALTY = -4
+RELATIVE_INDENT_WITH_BLANK_PENALTY = 10
+RELATIVE_OUTDENT_PENALTY = 24
+RELATIVE_OUTDENT_WITH_BLANK_PENALTY = 17
+RELATIVE_DEDENT_PENALTY = 23
+RELATIVE_DEDENT_WITH_BLANK_PENALTY = 17
+INDENT_WEIGHT = 60
+
+ALGORITHMS = ("myers", "histogram")
+
+# Every algorithm diff_changes implements
+SUPPORTED_ALGORITHMS = ("myers", "minimal", "patience", "histogram")
+
+# Line of a patience entry seen more than once on a side (xdiff/xpatience.c)
+NON_UNIQUE = LINE_MAX
+
+# Memory the per-blob line cache may hold, estimated from blob sizes and
+# line counts; 0 disables it. Each Python bytes object costs about
+# BYTES_OVERHEAD bytes beyond its data, plus a list slot.
+LINE_CACHE_BYTES = 256 * 1024 ** 2
+BYTES_OVERHEAD = 41
+
+
+def split_lines(data):
+    """Split blob bytes into records that keep their trailing newline"""
+    parts = data.split(b"\n")
+    records = [part + b"\n" for part in parts[:-1]]
+    if parts[-1]:
+        records.append(parts[-1])
+    return records
+
+
+def is_binary(data):
+    """git's buffer_is_binary(): a NUL byte within the first 8000 bytes"""
+    return b"\0" in data[:FIRST_FEW_BYTES]
+
+
+class BlobLines:
+    """A blob split into records, with each record's whitespace-free key (-w)
+
+    Keys are bytes objects, which keep their hash once computed, so a
+    cached BlobLines is interned again without rehashing its lines.
+    """
+
+    __slots__ = ("data", "recs", "keys")
+
+    def __init__(self, data):
+        self.data = data
+        self.recs = split_lines(data)
+        self.keys = [rec.translate(None, WHITESPACE) for rec in self.recs]
+
+    def size(self):
+        """Estimated memory held: data, records and keys"""
+        return 2 * len(self.data) + len(self.recs) * 2 * (BYTES_OVERHEAD + 8)
+
+
+class LineCache:
+    """LRU of BlobLines by blob id, bounded by their estimated memory
+
+    In a linear history the new blob of a file at one commit is its old
+    blob at the next one that touches it, so that blob is read from git and
+    split into lines once instead of twice.
+    """
+
+    def __init__(self, max_bytes=LINE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Blobs held by the largest of the caches merged into this one
+        self.held = 0
+
+    def get(self, object_id, read):
+        """BlobLines of a blob, calling read(object_id) for its data on a miss; None if read fails"""
+        lines = self.entries.get(object_id)
+        if lines is not None:
+            self.entries.move_to_end(object_id)
+            self.hits += 1
+            return lines
+
+        self.misses += 1
+        data = read(object_id)
+        if data is None:
+            return None
+        lines = BlobLines(data)
+        size = lines.size()
+        if size > self.max_bytes:
+            return lines
+        self.entries[object_id] = lines
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= evicted.size()
+            self.evictions += 1
+        return lines
+
+    def counters(self):
+        """What report() sums up, as plain values a worker process can return"""
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "held": len(self.entries), "bytes": self.bytes}
+
+    def merge(self, counters):
+        """Add the counters() of a LineCache in another process
+
+        Of what the caches held, the largest is reported.
+        """
+        self.hits += counters["hits"]
+        self.misses += counters["misses"]
+        self.evictions += counters["evictions"]
+        if counters["bytes"] > self.bytes:
+            self.held = counters["held"]
+            self.bytes = counters["bytes"]
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"Line cache: {self.hits:,} of {lookups:,} blobs reused ({rate:.1f}%), "
+                f"{self.evictions:,} evicted, {len(self.entries) or self.held:,} held in "
+                f"{self.bytes / 1024 ** 2:,.1f} of {self.max_bytes / 1024 ** 2:,.1f} MB")
+
+
+class DiffInput:
+    """Both sides of a blob pair split into records and interned into class ids
+
+    ignore_space and ignore_blank_lines mirror git's -w and
+    --ignore-blank-lines, which the study runs with.
+    """
+
+    def __init__(self, old, new, old_lines=None, new_lines=None, ignore_space=True, ignore_blank_lines=True):
+        old_lines = old_lines or BlobLines(old)
+        new_lines = new_lines or BlobLines(new)
+        self.old = old
+        self.new = new
+        self.recs1 = old_lines.recs
+        self.recs2 = new_lines.recs
+        self.ignore_space = ignore_space
+        self.ignore_blank_lines = ignore_blank_lines
+
+        # With -w, lines that only differ in whitespace share a class id
+        classes = {}
+        self.ha1 = [classes.setdefault(key, len(classes))
+                    for key in (old_lines.keys if ignore_space else old_lines.recs)]
+        self.ha2 = [classes.setdefault(key, len(classes))
+                    for key in (new_lines.keys if ignore_space else new_lines.recs)]
+        self.blank_class = classes.get(b"")
+
+    @classmethod
+    def from_lines(cls, old_lines, new_lines, ignore_space=True, ignore_blank_lines=True):
+        return cls(old_lines.data, new_lines.data, old_lines, new_lines, ignore_space, ignore_blank_lines)
+
+    def blank(self, side, start, count):
+        """Whether lines start..start+count of a side are all blank (xdl_blankline)"""
+        if self.ignore_space:
+            ha = self.ha1 if side == 1 else self.ha2
+            return all(h == self.blank_class for h in ha[start:start + count])
+        # Without whitespace flags git only counts lines of at most one byte
+        recs = self.recs1 if side == 1 else self.recs2
+        return all(len(rec) <= 1 for rec in recs[start:start + count])
+
+    def is_binary(self):
+        return is_binary(self.old) or is_binary(self.new)
+
+
+def bogosqrt(n):
+    i = 1
+    while n > 0:
+        i <<= 1
+        n >>= 2
+    return i
+
+
+def _clean_mmatch(dis, i, s, e):
+    """Decide whether a multi-match line sits in a run of unmatched lines"""
+    if i - s > SIMSCAN_WINDOW:
+        s = i - SIMSCAN_WINDOW
+    if e - i > SIMSCAN_WINDOW:
+        e = i + SIMSCAN_WINDOW
+
+    r = 1
+    rdis0 = 0
+    rpdis0 = 1
+    while i - r >= s:
+        if not dis[i - r]:
+            rdis0 += 1
+        elif dis[i - r] == 2:
+            rpdis0 += 1
+        else:
+            break
+        r += 1
+    if rdis0 == 0:
+        return False
+
+    r = 1
+    rdis1 = 0
+    rpdis1 = 1
+    while i + r <= e:
+        if not dis[i + r]:
+            rdis1 += 1
+        elif dis[i + r] == 2:
+            rpdis1 += 1
+        else:
+            break
+        r += 1
+    if rdis1 == 0:
+        return False
+
+    rdis1 += rdis0
+    rpdis1 += rpdis0
+    return rpdis1 * KPDIS_RUN < rpdis1 + rdis1
+
+
+def _split(ha1, off1, lim1, ha2, off2, lim2, kvdf, kvdb, koff, need_min, mxcost):
+    """Find the middle snake of the box; returns (i1, i2, min_lo, min_hi)"""
+    dmin = off1 - lim2
+    dmax = lim1 - off2
+    fmid = off1 - off2
+    bmid = lim1 - lim2
+    odd = (fmid - bmid) & 1
+    fmin = fmax = fmid
+    bmin = bmax = bmid
+
+    kvdf[fmid + koff] = off1
+    kvdb[bmid + koff] = lim1
+
+    ec = 0
+    while True:
+        ec += 1
+        got_snake = False
+
+        if fmin > dmin:
+            fmin -= 1
+            kvdf[fmin - 1 + koff] = -1
+        else:
+            fmin += 1
+        if fmax < dmax:
+            fmax += 1
+            kvdf[fmax + 1 + koff] = -1
+        else:
+            fmax -= 1
+
+        for d in range(fmax, fmin - 1, -2):
+            if kvdf[d - 1 + koff] >= kvdf[d + 1 + koff]:
+                i1 = kvdf[d - 1 + koff] + 1
+            else:
+                i1 = kvdf[d + 1 + koff]
+            prev1 = i1
+            i2 = i1 - d
+            while i1 < lim1 and i2 < lim2 and ha1[i1] == ha2[i2]:
+                i1 += 1
+                i2 += 1
+            if i1 - prev1 > SNAKE_CNT:
+                got_snake = True
+            kvdf[d + koff] = i1
+            if odd and bmin <= d <= bmax and kvdb[d + koff] <= i1:
+                return i1, i2, True, True
+
+        if bmin > dmin:
+            bmin -= 1
+            kvdb[bmin - 1 + koff] = LINE_MAX
+        else:
+            bmin += 1
+        if bmax < dmax:
+            bmax += 1
+            kvdb[bmax + 1 + koff] = LINE_MAX
+        else:
+            bmax -= 1
+
+        for d in range(bmax, bmin - 1, -2):
+            if kvdb[d - 1 + koff] < kvdb[d + 1 + koff]:
+                i1 = kvdb[d - 1 + koff]
+            else:
+                i1 = kvdb[d + 1 + koff] - 1
+            prev1 = i1
+            i2 = i1 - d
+            while i1 > off1 and i2 > off2 and ha1[i1 - 1] == ha2[i2 - 1]:
+                i1 -= 1
+                i2 -= 1
+            if prev1 - i1 > SNAKE_CNT:
+                got_snake = True
+            kvdb[d + koff] = i1
+            if not odd and fmin <= d <= fmax and i1 <= kvdf[d + koff]:
+                return i1, i2, True, True
+
+        if need_min:
+            continue
+
+        # Past the heuristic trigger, accept a long enough snake far from the corner
+        if got_snake and ec > HEUR_MIN_COST:
+            best = 0
+            for d in range(fmax, fmin - 1, -2):
+                dd = d - fmid if d > fmid else fmid - d
+                i1 = kvdf[d + koff]
+                i2 = i1 - d
+                v = (i1 - off1) + (i2 - off2) - dd
+                if (v > K_HEUR * ec and v > best
+                        and off1 + SNAKE_CNT <= i1 < lim1
+                        and off2 + SNAKE_CNT <= i2 < lim2):
+                    k = 1
+                    while ha1[i1 - k] == ha2[i2 - k]:
+                        if k == SNAKE_CNT:
+                            best = v
+                            spl1, spl2 = i1, i2
+                            break
+                        k += 1
+            if best > 0:
+                return spl1, spl2, True, False
+
+            best = 0
+            for d in range(bmax, bmin - 1, -2):
+                dd = d - bmid if d > bmid else bmid - d
+                i1 = kvdb[d + koff]
+                i2 = i1 - d
+                v = (lim1 - i1) + (lim2 - i2) - dd
+                if (v > K_HEUR * ec and v > best
+                        and off1 < i1 <= lim1 - SNAKE_CNT
+                        and off2 < i2 <= lim2 - SNAKE_CNT):
+                    k = 0
+                    while ha1[i1 + k] == ha2[i2 + k]:
+                        if k == SNAKE_CNT - 1:
+                            best = v
+                            spl1, spl2 = i1, i2
+                            break
+                        k += 1
+            if best > 0:
+                return spl1, spl2, False, True
+
+        # Too expensive: take the furthest reaching path found so far
+        if ec >= mxcost:
+            fbest = fbest1 = -1
+            for d in range(fmax, fmin - 1, -2):
+                i1 = min(kvdf[d + koff], lim1)
+                i2 = i1 - d
+                if lim2 < i2:
+                    i1 = lim2 + d
+                    i2 = lim2
+                if fbest < i1 + i2:
+                    fbest = i1 + i2
+                    fbest1 = i1
+
+            bbest = bbest1 = LINE_MAX
+            for d in range(bmax, bmin - 1, -2):
+                i1 = max(off1, kvdb[d + koff])
+                i2 = i1 - d
+                if i2 < off2:
+                    i1 = off2 + d
+                    i2 = off2
+                if i1 + i2 < bbest:
+                    bbest = i1 + i2
+                    bbest1 = i1
+
+            if (lim1 + lim2) - bbest < fbest - (off1 + off2):
+                return fbest1, fbest - fbest1, True, False
+            return bbest1, bbest - bbest1, False, True
+
+
+def myers(ha1, ha2, need_min=False):
+    """Mark changed records of two class-id sequences the way xdiff's Myers does
+
+    Returns (rchg1, rchg2). Each has one extra trailing zero so that index -1
+    reads as "unchanged", like the sentinels around xdiff's rchg arrays.
+    """
+    n1 = len(ha1)
+    n2 = len(ha2)
+    rchg1 = bytearray(n1 + 1)
+    rchg2 = bytearray(n2 + 1)
+    if n1 + n2 >= VECTOR_MIN_RECORDS:
+        rindex1, ref1, rindex2, ref2 = _prepare_vector(ha1, ha2, rchg1, rchg2)
+    else:
+        rindex1, ref1, rindex2, ref2 = _prepare(ha1, ha2, rchg1, rchg2)
+
+    ndiags = len(ref1) + len(ref2) + 3
+    koff = len(ref2) + 1
+    kvdf = [0] * ndiags
+    kvdb = [0] * ndiags
+    mxcost = max(bogosqrt(ndiags), MAX_COST_MIN)
+
+    # xdl_recs_cmp, with an explicit stack instead of recursion
+    stack = [(0, len(ref1), 0, len(ref2), need_min)]
+    while stack:
+        off1, lim1, off2, lim2, minimal = stack.pop()
+        while off1 < lim1 and off2 < lim2 and ref1[off1] == ref2[off2]:
+            off1 += 1
+            off2 += 1
+        while off1 < lim1 and off2 < lim2 and ref1[lim1 - 1] == ref2[lim2 - 1]:
+            lim1 -= 1
+            lim2 -= 1
+
+        if off1 == lim1:
+            for k in range(off2, lim2):
+                rchg2[rindex2[k]] = 1
+        elif off2 == lim2:
+            for k in range(off1, lim1):
+                rchg1[rindex1[k]] = 1
+        else:
+            i1, i2, min_lo, min_hi = _split(ref1, off1, lim1, ref2, off2, lim2,
+                                            kvdf, kvdb, koff, minimal, mxcost)
+            stack.append((i1, lim1, i2, lim2, min_hi))
+            stack.append((off1, i1, off2, i2, min_lo))
+
+    return rchg1, rchg2
+
+
+def _prepare(ha1, ha2, rchg1, rchg2):
+    """Records left for the search on each side, as (rindex1, ref1, rindex2, ref2)
+
+    rindex maps a position in ref back to its record. Records dropped
+    here are marked in rchg.
+    """
+    n1 = len(ha1)
+    n2 = len(ha2)
+
+    # xdl_trim_ends: common prefix and suffix never enter the search
+    lim = min(n1, n2)
+    dstart = 0
+    while dstart < lim and ha1[dstart] == ha2[dstart]:
+        dstart += 1
+    lim -= dstart
+    tail = 0
+    while tail < lim and ha1[n1 - 1 - tail] == ha2[n2 - 1 - tail]:
+        tail += 1
+
+    # xdl_cleanup_records: lines without a counterpart are changed outright
+    count1 = Counter(ha1)
+    count2 = Counter(ha2)
+    rindex1, ref1 = _cleanup_side(ha1, dstart, n1 - tail - 1, count2, rchg1)
+    rindex2, ref2 = _cleanup_side(ha2, dstart, n2 - tail - 1, count1, rchg2)
+    return rindex1, ref1, rindex2, ref2
+
+
+def _prepare_vector(ha1, ha2, rchg1, rchg2):
+    """_prepare over NumPy arrays of the class ids"""
+    a1 = np.array(ha1, dtype=np.int64)
+    a2 = np.array(ha2, dtype=np.int64)
+    n1 = len(a1)
+    n2 = len(a2)
+
+    lim = min(n1, n2)
+    differ = np.flatnonzero(a1[:lim] != a2[:lim])
+    dstart = int(differ[0]) if differ.size else lim
+    lim -= dstart
+    differ = np.flatnonzero(a1[n1 - lim:][::-1] != a2[n2 - lim:][::-1])
+    tail = int(differ[0]) if differ.size else lim
+
+    classes = max(int(a1.max(initial=-1)), int(a2.max(initial=-1))) + 1
+    count1 = np.bincount(a1, minlength=classes)
+    count2 = np.bincount(a2, minlength=classes)
+    rindex1, ref1 = _cleanup_side_vector(a1, dstart, n1 - tail - 1, count2, rchg1)
+    rindex2, ref2 = _cleanup_side_vector(a2, dstart, n2 - tail - 1, count1, rchg2)
+    return rindex1, ref1, rindex2, ref2
+
+
+def _cleanup_side_vector(ha, dstart, dend, other_count, rchg):
+    """_cleanup_side with every _clean_mmatch scan answered from prefix sums"""
+    mlim = min(bogosqrt(len(ha)), MAX_EQLIMIT)
+    seg = ha[dstart:dend + 1]
+    n = len(seg)
+    nm = other_count[seg]
+    dis = np.where(nm == 0, 0, np.where(nm >= mlim, 2, 1))
+    keep = dis == 1
+
+    multi = np.flatnonzero(dis == 2)
+    if multi.size:
+        # The scans around a multi-match line stop at the nearest line
+        # matched once on either side, or SIMSCAN_WINDOW lines away
+        pos = np.arange(n)
+        last_one = np.maximum.accumulate(np.where(keep, pos, -1))[multi]
+        next_one = np.minimum.accumulate(np.where(keep, pos, n)[::-1])[::-1][multi]
+        lo = np.maximum(last_one + 1, np.maximum(multi - SIMSCAN_WINDOW, 0))
+        hi = np.minimum(next_one, np.minimum(multi + SIMSCAN_WINDOW + 1, n))
+
+        zeros = np.concatenate(([0], np.cumsum(dis == 0)))
+        twos = np.concatenate(([0], np.cumsum(dis == 2)))
+        rdis0 = zeros[multi] - zeros[lo]
+        rdis1 = zeros[hi] - zeros[multi + 1]
+        rpdis = 2 + (twos[multi] - twos[lo]) + (twos[hi] - twos[multi + 1])
+        clean = (rdis0 > 0) & (rdis1 > 0) & (rpdis * KPDIS_RUN < rpdis + rdis0 + rdis1)
+        keep[multi[~clean]] = True
+
+    kept = np.flatnonzero(keep)
+    np.frombuffer(rchg, dtype=np.uint8)[np.flatnonzero(~keep) + dstart] = 1
+    return (kept + dstart).tolist(), seg[kept].tolist()
+
+
+def _cleanup_side(ha, dstart, dend, other_count, rchg):
+    mlim = min(bogosqrt(len(ha)), MAX_EQLIMIT)
+    dis = bytearray(len(ha) + 1)
+    for i in range(dstart, dend + 1):
+        nm = other_count.get(ha[i], 0)
+        dis[i] = 0 if nm == 0 else 2 if nm >= mlim else 1
+
+    rindex = []
+    ref = []
+    for i in range(dstart, dend + 1):
+        if dis[i] == 1 or (dis[i] == 2 and not _clean_mmatch(dis, i, dstart, dend)):
+            rindex.append(i)
+            ref.append(ha[i])
+        else:
+            rchg[i] = 1
+    return rindex, ref
+
+
+def _find_lcs(ha1, ha2, line1, count1, line2, count2, tables):
+    """Pick the longest common run anchored on the rarest lines (xhistogram)
+
+    Returns (fall_back, region) where region is (begin1, end1, begin2, end2)
+    using 1-based line numbers, or None when nothing is in common. tables
+    are histogram's (count, head, next_ptr) occurrence arrays, all zero on
+    entry and on return.
+    """
+    count, head, next_ptr = tables
+    end1 = line1 + count1 - 1
+    end2 = line2 + count2 - 1
+
+    # Index the first range from its end, so each class's chain of lines
+    # runs forward from head and next_ptr of its last line is 0
+    for ptr in range(end1, line1 - 1, -1):
+        h = ha1[ptr - 1]
+        next_ptr[ptr] = head[h]
+        head[h] = ptr
+        count[h] += 1
+
+    lcs = (0, 0, 0, 0)
+    max_cnt = HISTOGRAM_MAX_CHAIN + 1
+    has_common = False
+
+    b_ptr = line2
+    while b_ptr <= end2:
+        b_next = b_ptr + 1
+        rec_cnt = count[ha2[b_ptr - 1]]
+        if rec_cnt:
+            has_common = True
+            if rec_cnt <= max_cnt:
+                as_ = head[ha2[b_ptr - 1]]
+                while True:
+                    next_as = next_ptr[as_]
+                    bs = b_ptr
+                    ae = as_
+                    be = bs
+                    rc = rec_cnt
+
+                    while line1 < as_ and line2 < bs and ha1[as_ - 2] == ha2[bs - 2]:
+                        as_ -= 1
+                        bs -= 1
+                        if 1 < rc:
+                            rc = min(rc, count[ha1[as_ - 1]])
+                    while ae < end1 and be < end2 and ha1[ae] == ha2[be]:
+                        ae += 1
+                        be += 1
+                        if 1 < rc:
+                            rc = min(rc, count[ha1[ae - 1]])
+
+                    if b_next <= be:
+                        b_next = be + 1
+                    if lcs[1] - lcs[0] < ae - as_ or rc < max_cnt:
+                        lcs = (as_, ae, bs, be)
+                        max_cnt = rc
+
+                    while next_as and next_as <= ae:
+                        next_as = next_ptr[next_as]
+                    if next_as == 0:
+                        break
+                    as_ = next_as
+        b_ptr = b_next
+
+    # next_ptr is only read for lines of the range, so only the per-class tables need clearing
+    for ptr in range(line1, end1 + 1):
+        h = ha1[ptr - 1]
+        head[h] = 0
+        count[h] = 0
+
+    if has_common and HISTOGRAM_MAX_CHAIN < max_cnt:
+        return True, None
+    if lcs[0] == 0 and lcs[2] == 0:
+        return False, None
+    return False, lcs
+
+
+def histogram(ha1, ha2):
+    """Mark changed records of two class-id sequences the way xdiff's histogram does"""
+    rchg1 = bytearray(len(ha1) + 1)
+    rchg2 = bytearray(len(ha2) + 1)
+
+    # Occurrence tables shared by every region: per class id, its count and
+    # first line in the region's first range; per line, the next one of its class
+    classes = max(max(ha1, default=-1), max(ha2, default=-1)) + 1
+    tables = ([0] * classes, [0] * classes, [0] * (len(ha1) + 1))
+
+    stack = [(1, len(ha1), 1, len(ha2))]
+    while stack:
+        line1, count1, line2, count2 = stack.pop()
+        if count1 <= 0 and count2 <= 0:
+            continue
+        if not count1:
+            rchg2[line2 - 1:line2 - 1 + count2] = b"\1" * count2
+            continue
+        if not count2:
+            rchg1[line1 - 1:line1 - 1 + count1] = b"\1" * count1
+            continue
+
+        fall_back, lcs = _find_lcs(ha1, ha2, line1, count1, line2, count2, tables)
+        if fall_back:
+            sub1, sub2 = myers(ha1[line1 - 1:line1 - 1 + count1],
+                               ha2[line2 - 1:line2 - 1 + count2])
+            rchg1[line1 - 1:line1 - 1 + count1] = sub1[:count1]
+            rchg2[line2 - 1:line2 - 1 + count2] = sub2[:count2]
+        elif lcs is None:
+            rchg1[line1 - 1:line1 - 1 + count1] = b"\1" * count1
+            rchg2[line2 - 1:line2 - 1 + count2] = b"\1" * count2
+        else:
+            begin1, end1, begin2, end2 = lcs
+            stack.append((end1 + 1, line1 + count1 - 1 - end1,
+                          end2 + 1, line2 + count2 - 1 - end2))
+            stack.append((line1, begin1 - line1, line2, begin2 - line2))
+
+    return rchg1, rchg2
+
+
+def _patience_anchors(ha1, ha2, line1, count1, line2, count2):
+    """Longest run of lines unique on both sides, in order on both (xpatience)
+
+    Returns (has_matches, anchors) with anchors as 1-based (line1, line2)
+    pairs; has_matches is False when the ranges share no line at all.
+    """
+    # Entries keep the order in which lines first occur on the old side
+    entries = {}
+    for line in range(line1, line1 + count1):
+        entry = entries.get(ha1[line - 1])
+        if entry is None:
+            entries[ha1[line - 1]] = [line, 0]
+        else:
+            entry[1] = NON_UNIQUE
+    has_matches = False
+    for line in range(line2, line2 + count2):
+        entry = entries.get(ha2[line - 1])
+        if entry is not None:
+            has_matches = True
+            entry[1] = NON_UNIQUE if entry[1] else line
+
+    # Patience sorting on new-side line numbers, linking each entry to its predecessor
+    tails = []
+    sequence = []
+    for unique1, unique2 in entries.values():
+        if not unique2 or unique2 == NON_UNIQUE:
+            continue
+        i = bisect_left(tails, unique2)
+        node = (unique1, unique2, sequence[i - 1] if i else None)
+        if i == len(tails):
+            tails.append(unique2)
+            sequence.append(node)
+        else:
+            tails[i] = unique2
+            sequence[i] = node
+
+    anchors = []
+    node = sequence[-1] if sequence else None
+    while node is not None:
+        anchors.append(node[:2])
+        node = node[2]
+    anchors.reverse()
+    return has_matches, anchors
+
+
+def patience(ha1, ha2):
+    """Mark changed records of two class-id sequences the way xdiff's patience does"""
+    rchg1 = bytearray(len(ha1) + 1)
+    rchg2 = bytearray(len(ha2) + 1)
+
+    stack = [(1, len(ha1), 1, len(ha2))]
+    while stack:
+        line1, count1, line2, count2 = stack.pop()
+        if not count1:
+            rchg2[line2 - 1:line2 - 1 + count2] = b"\1" * count2
+            continue
+        if not count2:
+            rchg1[line1 - 1:line1 - 1 + count1] = b"\1" * count1
+            continue
+
+        has_matches, anchors = _patience_anchors(ha1, ha2, line1, count1, line2, count2)
+        if not has_matches:
+            rchg1[line1 - 1:line1 - 1 + count1] = b"\1" * count1
+            rchg2[line2 - 1:line2 - 1 + count2] = b"\1" * count2
+            continue
+        if not anchors:
+            sub1, sub2 = myers(ha1[line1 - 1:line1 - 1 + count1],
+                               ha2[line2 - 1:line2 - 1 + count2])
+            rchg1[line1 - 1:line1 - 1 + count1] = sub1[:count1]
+            rchg2[line2 - 1:line2 - 1 + count2] = sub2[:count2]
+            continue
+
+        # walk_common_sequence: grow each run of anchors to the common lines
+        # around it and diff the gaps between runs on their own
+        end1 = line1 + count1
+        end2 = line2 + count2
+        k = 0
+        while True:
+            if k < len(anchors):
+                next1, next2 = anchors[k]
+                while next1 > line1 and next2 > line2 and ha1[next1 - 2] == ha2[next2 - 2]:
+                    next1 -= 1
+                    next2 -= 1
+            else:
+                next1, next2 = end1, end2
+            while line1 < next1 and line2 < next2 and ha1[line1 - 1] == ha2[line2 - 1]:
+                line1 += 1
+                line2 += 1
+
+            if next1 > line1 or next2 > line2:
+                stack.append((line1, next1 - line1, line2, next2 - line2))
+            if k == len(anchors):
+                break
+
+            while (k + 1 < len(anchors) and anchors[k + 1][0] == anchors[k][0] + 1
+                   and anchors[k + 1][1] == anchors[k][1] + 1):
+                k += 1
+            line1 = anchors[k][0] + 1
+            line2 = anchors[k][1] + 1
+            k += 1
+
+    return rchg1, rchg2
+
+
+def agreement_reason(inp):
+    """Why myers and histogram must produce the same patch for inp, or None
+
+    Only cases that follow from how both algorithms mark records qualify:
+    binary pairs, a side without lines, sequences identical up to
+    whitespace, sequences sharing no line at all, and a single edit whose
+    old and new middles share no line with the other side, provided every
+    anchor histogram can pick is a line occurring once. Histogram does not
+    trim common ends, so a single edit amid repeated lines (a a a -> a X a a)
+    can still be anchored off-diagonal and is left to both algorithms.
+    """
+    if inp.is_binary():
+        return "binary"
+    ha1, ha2 = inp.ha1, inp.ha2
+    if not ha1 or not ha2:
+        return "one-sided"
+
+    counts = Counter(ha1)
+    if ha1 == ha2:
+        # The first new line must not be skipped as too common, so the full diagonal is found first
+        return "identical" if counts[ha1[0]] <= HISTOGRAM_MAX_CHAIN else None
+    new_classes = set(ha2)
+    if new_classes.isdisjoint(counts):
+        return "disjoint"
+
+    n1 = len(ha1)
+    n2 = len(ha2)
+    lim = min(n1, n2)
+    prefix = 0
+    while prefix < lim and ha1[prefix] == ha2[prefix]:
+        prefix += 1
+    lim -= prefix
+    suffix = 0
+    while suffix < lim and ha1[n1 - 1 - suffix] == ha2[n2 - 1 - suffix]:
+        suffix += 1
+    if not new_classes.isdisjoint(ha1[prefix:n1 - suffix]):
+        return None
+    if not counts.keys().isdisjoint(ha2[prefix:n2 - suffix]):
+        return None
+
+    # A run through a once-only line lies on the common diagonal and reaches
+    # across the whole prefix or suffix, so each step leaves one of the
+    # ranges below, which again needs such a line
+    head = ha1[:prefix]
+    tail = ha1[n1 - suffix:]
+    if not any(counts[line] == 1 for line in head + tail):
+        return None
+    if head and tail:
+        before = Counter(ha1[:n1 - suffix])
+        after = Counter(ha1[prefix:])
+        if not any(before[line] == 1 for line in head) or not any(after[line] == 1 for line in tail):
+            return None
+    return "single-edit"
+
+
+def get_indent(rec):
+    ret = 0
+    for c in rec:
+        if c not in WHITESPACE:
+            return ret
+        if c == 32:
+            ret += 1
+        elif c == 9:
+            ret += 8 - ret % 8
+        if ret >= MAX_INDENT:
+            return MAX_INDENT
+    # The line contains only whitespace
+    return -1
+
+
+def _score_split(recs, split, indents):
+    """Badness (effective_indent, penalty) of splitting recs before index split"""
+    def indent(i):
+        if i not in indents:
+            indents[i] = get_indent(recs[i])
+        return indents[i]
+
+    nrec = len(recs)
+    if split >= nrec:
+        end_of_file = True
+        line_indent = -1
+    else:
+        end_of_file = False
+        line_indent = indent(split)
+
+    pre_blank = 0
+    pre_indent = -1
+    for i in range(split - 1, -1, -1):
+        pre_indent = indent(i)
+        if pre_indent != -1:
+            break
+        pre_blank += 1
+        if pre_blank == MAX_BLANKS:
+            pre_indent = 0
+            break
+
+    post_blank = 0
+    post_indent = -1
+    for i in range(split + 1, nrec):
+        post_indent = indent(i)
+        if post_indent != -1:
+            break
+        post_blank += 1
+        if post_blank == MAX_BLANKS:
+            post_indent = 0
+            break
+
+    penalty = 0
+    if pre_indent == -1 and pre_blank == 0:
+        penalty += START_OF_FILE_PENALTY
+    if end_of_file:
+        penalty += END_OF_FILE_PENALTY
+
+    post_blank = 1 + post_blank if line_indent == -1 else 0
+    total_blank = pre_blank + post_blank
+    penalty += TOTAL_BLANK_WEIGHT * total_blank
+    penalty += POST_BLANK_WEIGHT * post_blank
+
+    effective = line_indent if line_indent != -1 else post_indent
+    any_blanks = total_blank != 0
+
+    if effective == -1 or pre_indent == -1:
+        pass
+    elif effective > pre_indent:
+        penalty += RELATIVE_INDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_INDENT_PENALTY
+    elif effective == pre_indent:
+        pass
+    elif post_indent != -1 and post_indent > effective:
+        penalty += RELATIVE_OUTDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_OUTDENT_PENALTY
+    else:
+        penalty += RELATIVE_DEDENT_WITH_BLANK_PENALTY if any_blanks else RELATIVE_DEDENT_PENALTY
+
+    return effective, penalty
+
+
+def _group_next(rchg, nrec, g):
+    if g[1] == nrec:
+        return False
+    g[0] = g[1] + 1
+    g[1] = g[0]
+    while rchg[g[1]]:
+        g[1] += 1
+    return True
+
+
+def _group_previous(rchg, g):
+    if g[0] == 0:
+        return False
+    g[1] = g[0] - 1
+    g[0] = g[1]
+    while rchg[g[0] - 1]:
+        g[0] -= 1
+    return True
+
+
+def _group_slide_down(rchg, ha, nrec, g):
+    if g[1] < nrec and ha[g[0]] == ha[g[1]]:
+        rchg[g[0]] = 0
+        rchg[g[1]] = 1
+        g[0] += 1
+        g[1] += 1
+        while rchg[g[1]]:
+            g[1] += 1
+        return True
+    return False
+
+
+def _group_slide_up(rchg, ha, g):
+    if g[0] > 0 and ha[g[0] - 1] == ha[g[1] - 1]:
+        g[0] -= 1
+        g[1] -= 1
+        rchg[g[0]] = 1
+        rchg[g[1]] = 0
+        while rchg[g[0] - 1]:
+            g[0] -= 1
+        return True
+    return False
+
+
+def change_compact(rchg, ha, recs, rchgo, nreco):
+    """Slide change groups to align with the other side and apply the indent heuristic"""
+    nrec = len(ha)
+    indents = {}
+    g = [0, 0]
+    while rchg[g[1]]:
+        g[1] += 1
+    go = [0, 0]
+    while rchgo[go[1]]:
+        go[1] += 1
+
+    while True:
+        if g[1] != g[0]:
+            while True:
+                groupsize = g[1] - g[0]
+                end_matching_other = -1
+
+                while _group_slide_up(rchg, ha, g):
+                    _group_previous(rchgo, go)
+                earliest_end = g[1]
+                if go[1] > go[0]:
+                    end_matching_other = g[1]
+
+                while _group_slide_down(rchg, ha, nrec, g):
+                    _group_next(rchgo, nreco, go)
+                    if go[1] > go[0]:
+                        end_matching_other = g[1]
+
+                if groupsize == g[1] - g[0]:
+                    break
+
+            if g[1] == earliest_end:
+                pass
+            elif end_matching_other != -1:
+                while go[1] == go[0]:
+                    _group_slide_up(rchg, ha, g)
+                    _group_previous(rchgo, go)
+            else:
+                shift = max(earliest_end, g[1] - groupsize - 1,
+                            g[1] - INDENT_HEURISTIC_MAX_SLIDING)
+                best_shift = -1
+                best_score = None
+                while shift <= g[1]:
+                    e1, p1 = _score_split(recs, shift, indents)
+                    e2, p2 = _score_split(recs, shift - groupsize, indents)
+                    score = (e1 + e2, p1 + p2)
+                    if best_shift == -1 or _score_cmp(score, best_score) <= 0:
+                        best_score = score
+                        best_shift = shift
+                    shift += 1
+                while g[1] > best_shift:
+                    _group_slide_up(rchg, ha, g)
+                    _group_previous(rchgo, go)
+
+        # Records unchanged on both sides are empty groups with nothing to
+        # slide; step over a run of them at once instead of one by one
+        ahead = rchg.find(1, g[1] + 1, nrec)
+        ahead_other = rchgo.find(1, go[1] + 1, nreco)
+        skip = min((nrec if ahead == -1 else ahead) - g[1] - 1,
+                   (nreco if ahead_other == -1 else ahead_other) - go[1] - 1)
+        if skip > 0:
+            g[0] = g[1] = g[1] + skip
+            go[0] = go[1] = go[1] + skip
+
+        if not _group_next(rchg, nrec, g):
+            break
+        _group_next(rchgo, nreco, go)
+
+
+def _score_cmp(s1, s2):
+    cmp_indents = (s1[0] > s2[0]) - (s1[0] < s2[0])
+    return INDENT_WEIGHT * cmp_indents + (s1[1] - s2[1])
+
+
+def build_script(rchg1, rchg2, n1, n2):
+    """Collect changed groups into (i1, i2, chg1, chg2) tuples in file order"""
+    changes = []
+    i1 = n1
+    i2 = n2
+    while i1 >= 0 or i2 >= 0:
+        if rchg1[i1 - 1] or rchg2[i2 - 1]:
+            l1 = i1
+            l2 = i2
+            while rchg1[i1 - 1]:
+                i1 -= 1
+            while rchg2[i2 - 1]:
+                i2 -= 1
+            changes.append((i1, i2, l1 - i1, l2 - i2))
+        i1 -= 1
+        i2 -= 1
+    changes.reverse()
+    return changes
+
+
+def diff_changes(inp, algorithm):
+    """Run one algorithm over a DiffInput and return the compacted edit script"""
+    if algorithm == "histogram":
+        rchg1, rchg2 = histogram(inp.ha1, inp.ha2)
+    elif algorithm in ("myers", "default"):
+        rchg1, rchg2 = myers(inp.ha1, inp.ha2)
+    elif algorithm == "minimal":
+        rchg1, rchg2 = myers(inp.ha1, inp.ha2, need_min=True)
+    elif algorithm == "patience":
+        rchg1, rchg2 = patience(inp.ha1, inp.ha2)
+    else:
+        raise ValueError(f"Unsupported diff algorithm: {algorithm}")
+
+    n1 = len(inp.ha1)
+    n2 = len(inp.ha2)
+    change_compact(rchg1, inp.ha1, inp.recs1, rchg2, n2)
+    change_compact(rchg2, inp.ha2, inp.recs2, rchg1, n1)
+    return build_script(rchg1, rchg2, n1, n2)
+
+
+def _func_line(rec):
+    """git's default funcname rule: lines starting with a letter, '_' or '$'"""
+    first = rec[:1]
+    if not first or not (first.isalpha() or first in b"_$"):
+        return None
+    return rec[:FUNC_LINE_MAX].rstrip(WHITESPACE)
+
+
+def _hunk_range(start, count):
+    text = str(start if count else start - 1)
+    if count != 1:
+        text += f",{count}"
+    return text
+
+
+def _emit(out, prefix, rec):
+    out.append(prefix + rec)
+    if not rec.endswith(b"\n"):
+        out.append(b"\n\\ No newline at end of file\n")
+
+
+def emit_hunks(inp, changes):
+    """Format an edit script as unified hunks, dropping blank-line-only changes with ignore_blank_lines"""
+    recs1 = inp.recs1
+    recs2 = inp.recs2
+    n1 = len(recs1)
+    n2 = len(recs2)
+    ignore = [inp.ignore_blank_lines and inp.blank(1, i1, c1) and inp.blank(2, i2, c2)
+              for i1, i2, c1, c2 in changes]
+
+    max_common = 2 * CONTEXT_LINES
+    max_ignorable = CONTEXT_LINES
+    out = []
+    func_line = b""
+    func_line_prev = -1
+    k = 0
+    count = len(changes)
+
+    while k < count:
+        # xdl_get_hunk: drop leading ignorable changes far from real ones
+        j = k
+        while j < count and ignore[j]:
+            if j + 1 == count or changes[j + 1][0] - (changes[j][0] + changes[j][2]) >= max_ignorable:
+                k = j + 1
+            j += 1
+        if k >= count:
+            break
+
+        last = k
+        ignored = 0
+        prev = k
+        for cur in range(k + 1, count):
+            distance = changes[cur][0] - (changes[prev][0] + changes[prev][2])
+            if distance > max_common:
+                break
+            if distance < max_ignorable and (not ignore[cur] or last == prev):
+                last = cur
+                ignored = 0
+            elif distance < max_ignorable and ignore[cur]:
+                ignored += changes[cur][3]
+            elif (last != prev and
+                  changes[cur][0] + ignored - (changes[last][0] + changes[last][2]) > max_common):
+                break
+            elif not ignore[cur]:
+                last = cur
+                ignored = 0
+            else:
+                ignored += changes[cur][3]
+            prev = cur
+
+        first_i1, first_i2 = changes[k][0], changes[k][1]
+        end_i1 = changes[last][0] + changes[last][2]
+        end_i2 = changes[last][1] + changes[last][3]
+        s1 = max(first_i1 - CONTEXT_LINES, 0)
+        s2 = max(first_i2 - CONTEXT_LINES, 0)
+        lctx = min(CONTEXT_LINES, n1 - end_i1, n2 - end_i2)
+        e1 = end_i1 + lctx
+        e2 = end_i2 + lctx
+
+        # Search backwards for a function line, stopping at the previous hunk's search
+        start = s1 - 1
+        step = -1 if start > func_line_prev else 1
+        line = start
+        while line != func_line_prev and 0 <= line < n1:
+            found = _func_line(recs1[line])
+            if found is not None:
+                func_line = found
+                break
+            line += step
+        func_line_prev = s1 - 1
+
+        header = f"@@ -{_hunk_range(s1 + 1, e1 - s1)} +{_hunk_range(s2 + 1, e2 - s2)} @@".encode()
+        if func_line:
+            header += b" " + func_line
+        out.append(header + b"\n")
+
+        for i in range(s2, first_i2):
+            _emit(out, b" ", recs2[i])
+        s1, s2 = first_i1, first_i2
+        for i1, i2, c1, c2 in changes[k:last + 1]:
+            while s1 < i1 and s2 < i2:
+                _emit(out, b" ", recs2[s2])
+                s1 += 1
+                s2 += 1
+            for i in range(i1, i1 + c1):
+                _emit(out, b"-", recs1[i])
+            for i in range(i2, i2 + c2):
+                _emit(out, b"+", recs2[i])
+            s1 = i1 + c1
+            s2 = i2 + c2
+        for i in range(end_i2, e2):
+            _emit(out, b" ", recs2[i])
+
+        k = last + 1
+
+    return b"".join(out)
+
+
+# Body of a patch between differing binary blobs; hunk bodies start with "@@"
+BINARY_BODY = b"Binary files differ\n"
+
+
+def diff_body(inp, algorithm):
+    """The path-independent part of a patch: hunk bytes, b"" or BINARY_BODY"""
+    if inp.is_binary():
+        return b"" if inp.old == inp.new else BINARY_BODY
+    return emit_hunks(inp, diff_changes(inp, algorithm))
+
+
+def render_patch(path, change, body):
+    """Wrap a diff_body in the headers `git diff -w --ignore-blank-lines` prints for path"""
+    old_mode, new_mode, old_id, new_id, _ = change
+    a_name = quote_path("a/", path)
+    b_name = quote_path("b/", path)
+    old_label = "/dev/null" if is_null_id(old_mode) else a_name
+    new_label = "/dev/null" if is_null_id(new_mode) else b_name
+
+    header = [f"diff --git {a_name} {b_name}\n"]
+    must_show_header = False
+    if is_null_id(old_mode):
+        header.append(f"new file mode {new_mode}\n")
+        must_show_header = True
+    elif is_null_id(new_mode):
+        header.append(f"deleted file mode {old_mode}\n")
+        must_show_header = True
+    elif old_mode != new_mode:
+        header.append(f"old mode {old_mode}\nnew mode {new_mode}\n")
+        must_show_header = True
+    if old_id != new_id:
+        index = f"index {old_id}..{new_id}"
+        if old_mode == new_mode:
+            index += f" {old_mode}"
+        header.append(index + "\n")
+    header = "".join(header).encode()
+
+    if body == BINARY_BODY:
+        body = f"Binary files {old_label} and {new_label} differ\n".encode()
+    elif body:
+        old_tab = "\t" if " " in old_label else ""
+        new_tab = "\t" if " " in new_label else ""
+        body = f"--- {old_label}{old_tab}\n+++ {new_label}{new_tab}\n".encode() + body
+
+    if not body and not must_show_header:
+        return ""
+    return (header + body).decode("utf-8", errors="replace")
+
+
+class NativeDiffer:
+    """get_diff-compatible front end that fetches each blob pair once and diffs in-process
+
+    Changed paths come from a persistent `git diff-tree --raw` worker and blob
+    contents from a persistent `git cat-file --batch`, both owned by the
+    GitDiffPool. Submodules, type changes and paths given a diff driver,
+    -diff or diff in the repository's attributes are handed to git unchanged.
+
+    With fast_path, a blob pair asked for with the second algorithm reuses
+    the first algorithm's body whenever agreement_reason proves they agree,
+    and agrees() answers whether it does without diffing at all. A
+    verify_rate share of those shortcuts is checked against `git diff`.
+    Blobs are read and split into lines through a LineCache of
+    line_cache_bytes, or directly when that is 0.
+    """
+
+    def __init__(self, pool, fast_path=True, verify_rate=0.0, seed=0, line_cache_bytes=LINE_CACHE_BYTES):
+        self.pool = pool
+        self.lines = LineCache(line_cache_bytes) if line_cache_bytes else None
+        self.fast_path = fast_path
+        self.verify_rate = verify_rate
+        self.rng = random.Random(seed)
+        self._last_key = None
+        self._last_input = None
+        self._last_reason = None
+        self._last_body = None
+        self.inputs = 0
+        self.fast_paths = Counter()
+        self.verified = 0
+        self.mismatches = 0
+
+    def get_diff(self, repo_dir, parent, child, path, algorithm):
+        if not parent or not path:
+            return None
+
+        changes = self.pool.tree_worker(repo_dir).get_file_diffs(parent, child)
+        if changes is None:
+            return None
+        change = changes.get(path)
+        if change is None:
+            return ""
+        if (change.status not in ("A", "M", "D") or "160000" in (change.old_mode, change.new_mode)
+                or self.pool.attribute_reader(repo_dir).git_diffs(path)):
+            return self.pool.get_diff(repo_dir, parent, child, path, algorithm)
+
+        if not self.load(repo_dir, change):
+            return None
+
+        last = self._last_body
+        if (self._last_reason is not None and last is not None
+                and last[0] != algorithm and algorithm in ALGORITHMS):
+            self.fast_paths[self._last_reason] += 1
+            text = render_patch(path, change, last[1])
+            if self.verify_rate and self.rng.random() < self.verify_rate:
+                self.verify(repo_dir, parent, child, path, algorithm, text)
+            return text
+
+        body = diff_body(self._last_input, algorithm)
+        if algorithm in ALGORITHMS:
+            self._last_body = (algorithm, body)
+        return render_patch(path, change, body)
+
+    def agrees(self, repo_dir, parent, child, path):
+        """Whether agreement_reason proves both algorithms give path the same patch
+
+        The blobs read are kept, so a get_diff of the same file that follows
+        a False does not read them again.
+        """
+        if not self.fast_path or not parent or not path:
+            return False
+        changes = self.pool.tree_worker(repo_dir).get_file_diffs(parent, child)
+        change = (changes or {}).get(path)
+        if (change is None or change.status not in ("A", "M", "D")
+                or "160000" in (change.old_mode, change.new_mode)
+                or self.pool.attribute_reader(repo_dir).git_diffs(path)):
+            return False
+        if not self.load(repo_dir, change) or self._last_reason is None:
+            return False
+
+        self.fast_paths[self._last_reason] += 1
+        if self.verify_rate and self.rng.random() < self.verify_rate:
+            self.verified += 1
+            patches = [self.pool.get_diff(repo_dir, parent, child, path, algorithm) for algorithm in ALGORITHMS]
+            if patches[0] != patches[1]:
+                self.mismatches += 1
+                print(f"Fast path mismatch: {path} at {child} ({self._last_reason})")
+        return True
+
+    def load(self, repo_dir, change):
+        """Make a change's blob pair the current input, reading it unless it already is; False if unreadable"""
+        key = (repo_dir, change.old_id, change.new_id)
+        if key != self._last_key:
+            inp = self.read_input(repo_dir, change)
+            if inp is None:
+                return False
+            self._last_key = key
+            self._last_input = inp
+            self._last_reason = agreement_reason(self._last_input) if self.fast_path else None
+            self._last_body = None
+            self.inputs += 1
+        return True
+
+    def read_input(self, repo_dir, change):
+        """DiffInput of a change's blob pair, or None if a blob cannot be read"""
+        reader = self.pool.blob_reader(repo_dir)
+        if self.lines is None:
+            old = reader.read(change.old_id)
+            new = reader.read(change.new_id)
+            if old is None or new is None:
+                return None
+            return DiffInput(old, new)
+
+        # Abbreviated ids are only unique within a repository
+        def read(key):
+            return reader.read(key[1])
+
+        old = self.lines.get((repo_dir, change.old_id), read)
+        new = self.lines.get((repo_dir, change.new_id), read)
+        if old is None or new is None:
+            return None
+        return DiffInput.from_lines(old, new)
+
+    def verify(self, repo_dir, parent, child, path, algorithm, text):
+        """Compare a reused patch with the one git computes itself"""
+        self.verified += 1
+        expected = self.pool.get_diff(repo_dir, parent, child, path, algorithm)
+        if expected != text:
+            self.mismatches += 1
+            print(f"Fast path mismatch: {path} at {child} ({algorithm}, {self._last_reason})")
+
+    def counters(self):
+        """What report() sums up, as plain values a worker process can return"""
+        return {"inputs": self.inputs, "fast_paths": self.fast_paths,
+                "verified": self.verified, "mismatches": self.mismatches}
+
+    def merge(self, counters):
+        """Add the counters() of a NativeDiffer in another process"""
+        self.inputs += counters["inputs"]
+        self.fast_paths.update(counters["fast_paths"])
+        self.verified += counters["verified"]
+        self.mismatches += counters["mismatches"]
+
+    def report(self):
+        taken = sum(self.fast_paths.values())
+        reasons = ", ".join(f"{count:,} {reason}" for reason, count in self.fast_paths.most_common())
+        line = f"Fast path: {taken:,} of {self.inputs:,} files proven to agree ({reasons or 'none'})"
+        if self.verified:
+            line += f"; {self.verified:,} checked against git, {self.mismatches:,} mismatched"
+        return line
+
+
+class FastComparer:
+    """StreamComparer-compatible front end for rows that keep no diff text
+
+    Files that NativeDiffer.agrees() proves identical under both algorithms
+    are answered without diffing; the rest are diffed through diff, which
+    may wrap the same NativeDiffer, and the two patches compared.
+    """
+
+    def __init__(self, native, diff):
+        self.native = native
+        self.diff = diff
+
+    def compare(self, repo_dir, parent, child, path):
+        """True if the diffs differ, False if they are identical, None if git fails"""
+        if self.native.agrees(repo_dir, parent, child, path):
+            return False
+        diff_myers = self.diff(repo_dir, parent, child, path, "myers")
+        diff_histogram = self.diff(repo_dir, parent, child, path, "histogram")
+        if diff_myers is None or diff_histogram is None:
+            return None
+        return diff_myers != diff_histogram
@@ -0,0 +1,203 @@
+"""
+Results Database
+Indexed SQLite copy of the dataset's per-file results for sliced queries, and its query CLI
+"""
+
+import argparse
+import calendar
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+import pandas as pd
+
+RESULTS_PATH = "results.sqlite"
+
+# Rows inserted per executemany call
+INSERT_ROWS = 10000
+
+# Every index ends in discrepancy and covers the columns a slice filters
+# on, so a count over a slice reads one index range and never the table.
+# A query filtering on repository, extension and dates uses the first one.
+INDEXES = (
+    ("repository", "file_extension", "author_time", "discrepancy"),
+    ("repository", "file_type", "author_time", "discrepancy"),
+    ("file_extension", "author_time", "discrepancy"),
+    ("file_type", "author_time", "discrepancy"),
+    ("author_time", "discrepancy"),
+    ("discrepancy",),
+)
+
+# Columns a query can group on; "year" and "month" are derived from author_time
+GROUP_COLUMNS = {
+    "repository": "repository",
+    "file_type": "file_type",
+    "file_extension": "file_extension",
+    "year": "CAST(strftime('%Y', author_time, 'unixepoch') AS INTEGER)",
+    "month": "strftime('%Y-%m', author_time, 'unixepoch')",
+}
+
+
+class ResultsWriter:
+    """Builds results.sqlite from the rows the dataset is written from
+
+    One row per analyzed file: where it sits in history (repository, commit
+    and the commit's author time), its file type and extension and whether
+    the algorithms disagreed, without the diff text. The table is built in a
+    staging file, indexed once all rows are in, and swapped in on close, so
+    it always matches the dataset of the same run. commit_times(repo_name)
+    gives {sha: unix author time} for a repository.
+    """
+
+    def __init__(self, commit_times, path=RESULTS_PATH):
+        self.commit_times = commit_times
+        self.times = {}
+        self.path = path
+        self.staging = path + ".tmp"
+        if os.path.exists(self.staging):
+            os.remove(self.staging)
+        self.conn = sqlite3.connect(self.staging)
+        # The staging file is thrown away if the run fails, so skip the journal
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("""
+            CREATE TABLE results (
+                repository TEXT NOT NULL,
+                commit_sha TEXT NOT NULL,
+                author_time INTEGER,
+                old_file_path TEXT,
+                new_file_path TEXT,
+                file_type TEXT NOT NULL,
+                file_extension TEXT NOT NULL,
+                discrepancy INTEGER NOT NULL
+            )""")
+        self.pending = []
+        self.rows = 0
+
+    def add(self, row):
+        repo_name = row["repository"]
+        if repo_name not in self.times:
+            self.times[repo_name] = self.commit_times(repo_name)
+        self.pending.append((
+            repo_name, row["commit_sha"], self.times[repo_name].get(row["commit_sha"]),
+            row["old_file_path"] or None, row["new_file_path"] or None,
+            row["file_type"], row["file_extension"], int(row["discrepancy"] == "Yes"),
+        ))
+        if len(self.pending) >= INSERT_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+        self.rows += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        for columns in INDEXES:
+            self.conn.execute(f"CREATE INDEX results_{'_'.join(columns)} ON results ({', '.join(columns)})")
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+        self.conn.close()
+        os.replace(self.staging, self.path)
+
+    def abort(self):
+        self.conn.close()
+        os.remove(self.staging)
+
+
+def parse_time(text, end=False):
+    """Unix time at the start of "YYYY", "YYYY-MM" or "YYYY-MM-DD" (UTC), or at the end with end=True"""
+    fields = [int(field) for field in str(text).split("-")]
+    year, month, day = fields + [1] * (3 - len(fields))
+    if end:
+        if len(fields) == 1:
+            year += 1
+        elif len(fields) == 2:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        else:
+            return calendar.timegm((year, month, day, 0, 0, 0)) + 86400
+    return calendar.timegm((year, month, day, 0, 0, 0))
+
+
+def where_clause(repository=None, file_type=None, extension=None, since=None, until=None):
+    """SQL condition and parameters for a slice; filters take a value or a list of values"""
+    conditions = []
+    params = []
+    for column, value in (("repository", repository), ("file_type", file_type),
+                          ("file_extension", extension)):
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+    # since and until are inclusive: until=2021 runs to the end of 2021
+    if since is not None:
+        conditions.append("author_time >= ?")
+        params.append(parse_time(since))
+    if until is not None:
+        conditions.append("author_time < ?")
+        params.append(parse_time(until, end=True))
+    return " AND ".join(conditions) or "1", params
+
+
+def connect(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def discrepancy_rates(by=(), path=RESULTS_PATH, **filters):
+    """Files, discrepancies and discrepancy rate (%) of a slice, per value of the `by` columns
+
+    by names columns of GROUP_COLUMNS; filters are those of where_clause.
+    """
+    where, params = where_clause(**filters)
+    groups = [f"{GROUP_COLUMNS[column]} AS {column}" for column in by]
+    group_by = f"GROUP BY {', '.join(by)} ORDER BY {', '.join(by)}" if by else ""
+    query = (f"SELECT {', '.join([*groups, 'COUNT(*) AS files', 'COALESCE(SUM(discrepancy), 0) AS discrepancies'])} "
+             f"FROM results WHERE {where} {group_by}")
+    with closing(connect(path)) as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    if not by and not df.loc[0, "files"]:
+        df = df.iloc[:0]
+    df["rate"] = df["discrepancies"] / df["files"] * 100
+    return df
+
+
+def read_results(columns=None, path=RESULTS_PATH, **filters):
+    """Rows of a slice, discrepancy as "Yes"/"No" like the dataset, and author_time as unix time"""
+    where, params = where_clause(**filters)
+    select = ", ".join(columns) if columns else "*"
+    with closing(connect(path)) as conn:
+        df = pd.read_sql_query(f"SELECT {select} FROM results WHERE {where}", conn, params=params)
+    if "discrepancy" in df:
+        df["discrepancy"] = df["discrepancy"].map({1: "Yes", 0: "No"})
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Discrepancy rates over a slice of results.sqlite")
+    parser.add_argument("--repository", action="append", help="repository name (repeatable)")
+    parser.add_argument("--file-type", action="append", help="file type, e.g. Source (repeatable)")
+    parser.add_argument("--extension", action="append", help="file extension, e.g. .c (repeatable)")
+    parser.add_argument("--since", help="first author date: YYYY, YYYY-MM or YYYY-MM-DD")
+    parser.add_argument("--until", help="last author date, inclusive: YYYY, YYYY-MM or YYYY-MM-DD")
+    parser.add_argument("--by", action="append", default=[], choices=list(GROUP_COLUMNS),
+                        help="group the counts by this column (repeatable)")
+    parser.add_argument("--db", default=RESULTS_PATH, help=f"results database (default {RESULTS_PATH})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = discrepancy_rates(args.by, args.db, repository=args.repository, file_type=args.file_type,
+                           extension=args.extension, since=args.since, until=args.until)
+    elapsed = time.perf_counter() - start
+    if df.empty:
+        print("No files in this slice")
+    else:
+        print(df.to_string(index=False, formatters={"rate": "{:.2f}%".format}))
+    print(f"({elapsed * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
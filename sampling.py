@@ -0,0 +1,144 @@
+"""
+Commit Sampling
+Seeded random and stratified commit samples, and a sequential stopping rule for the discrepancy rate
+"""
+
+import math
+import random
+import subprocess
+import time
+from collections import Counter, defaultdict, namedtuple
+from statistics import NormalDist
+
+CommitMeta = namedtuple("CommitMeta", "sha timestamp author")
+
+STRATA = ("time", "author", "file_type")
+
+
+def list_commit_meta(repo_dir, revisions=("HEAD",)):
+    """Every selected commit, oldest first, with its author time and email"""
+    out = subprocess.check_output(
+        ["git", "log", "--reverse", "--format=%H %at %ae", *revisions],
+        cwd=repo_dir
+    ).decode("utf-8", errors="replace")
+    commits = []
+    for line in out.splitlines():
+        sha, timestamp, author = line.split(" ", 2)
+        commits.append(CommitMeta(sha, int(timestamp), author))
+    return commits
+
+
+def list_commit_paths(repo_dir, revisions=("HEAD",)):
+    """{sha: [paths changed against the first parent]} for the selected commits
+
+    Every selected commit is walked, side branches included; only merges
+    are diffed against their first parent alone.
+    """
+    out = subprocess.check_output(
+        ["git", "-c", "core.quotepath=false", "log", "--diff-merges=first-parent", "--no-renames",
+         "--format=%x00%H", "--name-only", *revisions],
+        cwd=repo_dir
+    ).decode("utf-8", errors="replace")
+    paths = {}
+    for record in out.split("\0")[1:]:
+        sha, _, names = record.partition("\n")
+        paths[sha] = [name for name in names.splitlines() if name]
+    return paths
+
+
+def strata_keys(repo_dir, commits, by, classify, revisions=("HEAD",)):
+    """Stratum of each commit: author year, author email or most common file type"""
+    if by == "time":
+        return [time.gmtime(commit.timestamp).tm_year for commit in commits]
+    if by == "author":
+        return [commit.author for commit in commits]
+    if by == "file_type":
+        paths = list_commit_paths(repo_dir, revisions)
+        keys = []
+        for commit in commits:
+            types = Counter(map(classify, paths.get(commit.sha, ())))
+            keys.append(types.most_common(1)[0][0] if types else "None")
+        return keys
+    raise ValueError(f"unknown stratification {by!r}, expected one of {STRATA}")
+
+
+def random_sample(commits, size, seed):
+    """Simple random sample of commits, returned in history order"""
+    rng = random.Random(seed)
+    chosen = rng.sample(range(len(commits)), min(size, len(commits)))
+    return [commits[i] for i in sorted(chosen)]
+
+
+def stratified_sample(commits, keys, size, seed):
+    """Proportionally allocated stratified sample, returned in history order
+
+    Each stratum gets its share of size rounded down, and the leftover
+    slots go to the largest remainders, so the sample is self-weighting.
+    """
+    strata = defaultdict(list)
+    for i, key in enumerate(keys):
+        strata[key].append(i)
+    size = min(size, len(commits))
+
+    quotas = {key: size * len(members) / len(commits) for key, members in strata.items()}
+    allocation = {key: int(quota) for key, quota in quotas.items()}
+    leftover = size - sum(allocation.values())
+    by_remainder = sorted(strata, key=lambda key: (allocation[key] - quotas[key], str(key)))
+    for key in by_remainder[:leftover]:
+        allocation[key] += 1
+
+    rng = random.Random(seed)
+    chosen = []
+    for key in sorted(strata, key=str):
+        chosen.extend(rng.sample(strata[key], allocation[key]))
+    return [commits[i] for i in sorted(chosen)]
+
+
+def sequential_order(commits, seed):
+    """Seeded random visiting order for sequential sampling"""
+    order = list(commits)
+    random.Random(seed).shuffle(order)
+    return order
+
+
+class RateEstimate:
+    """File-level discrepancy rate estimated from whole sampled commits
+
+    Commits are clusters of files, so the interval comes from the ratio
+    estimator's variance across commits, with a finite population
+    correction. It is never narrower than the Wilson interval on the file
+    counts, which keeps an early run of all-agreeing commits from stopping
+    the sample with a zero-width interval.
+    """
+
+    def __init__(self, population, confidence=0.95):
+        self.population = population
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.clusters = []
+        self.files = 0
+        self.discrepancies = 0
+
+    def add(self, files, discrepancies):
+        self.clusters.append((files, discrepancies))
+        self.files += files
+        self.discrepancies += discrepancies
+
+    def rate(self):
+        return self.discrepancies / self.files if self.files else 0.0
+
+    def half_width(self):
+        n = len(self.clusters)
+        if n < 2 or not self.files:
+            return math.inf
+        p = self.rate()
+        mean_files = self.files / n
+        spread = sum((d - p * m) ** 2 for m, d in self.clusters) / (n - 1)
+        fpc = max(1 - n / self.population, 0) if self.population else 1
+        cluster = self.z * math.sqrt(fpc * spread / n) / mean_files
+
+        z2 = self.z ** 2
+        wilson = (self.z * math.sqrt(p * (1 - p) / self.files + z2 / (4 * self.files ** 2))
+                  / (1 + z2 / self.files))
+        if fpc == 0:
+            return 0.0
+        return max(cluster, wilson)
@@ -3,11 +3,38 @@ Diff Algorithm Analysis
 Comparing Myers vs Histogram diff algorithms across three repositories
 """
 
+import asyncio
+import hashlib
 import os
 import subprocess
-import pandas as pd
-from pydriller import Repository
+from concurrent.futures import ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from functools import lru_cache
+from multiprocessing import Manager
 from tqdm import tqdm
+from async_diff import AsyncDiffer, gather_in_order
+from checkpoint import CHECKPOINT_DIR, Checkpoint, StreamRows, commit_positions
+from dataset_store import DatasetWriter
+from diff_cache import CACHE_PATH, CachedDiffer, DiffCache
+from diff_store import STORE_PATH, DiffStore, DigestRows
+from file_filter import (FILE_TIME_BUDGET, MAX_FILE_BYTES, SKIP_GLOBS, SLOW, SLOW_FILE_BYTES, TIMEOUT,
+                         FileFilter)
+from git_pool import CommitDiffer, GitDiffPool
+from log_stream import change_paths, count_commits, iter_commits, iter_log_pairs, list_commits
+from native_diff import LINE_CACHE_BYTES, FastComparer, LineCache, NativeDiffer
+from results_db import RESULTS_PATH, ResultsWriter
+from sampling import (RateEstimate, list_commit_meta, random_sample, sequential_order,
+                      strata_keys, stratified_sample)
+from stats_cube import CUBE_PATH, StatsCube
+from stream_compare import StreamComparer
+from sweep import Sweep
+from tree_changes import iter_changes
+
+# pydriller is only needed for COLLECTION_MODE = "traverse"
+try:
+    from pydriller import Git
+except ImportError:
+    Git = None
 
 # Repository paths
 repositories = [
@@ -16,6 +43,165 @@ repositories = [
     ("openhands", "/home/set-iitgn-vm/STT_A4/OpenHands")
 ]
 
+# "native" fetches each blob pair once and diffs both algorithms in-process,
+# "pool" keeps one long-lived git process per repository and algorithm,
+# "commit" runs one `git diff` per commit and algorithm,
+# "subprocess" spawns a fresh `git diff` for every file
+DIFF_BACKEND = "native"
+
+# The native backend diffs a file once when both algorithms provably agree
+# (see native_diff.agreement_reason); FAST_PATH_VERIFY is the share of those
+# files also diffed by git to check the shortcut
+FAST_PATH = True
+FAST_PATH_VERIFY = 0.0
+
+# The native backend keeps recently read blobs split into lines, up to
+# about LINE_CACHE_SIZE bytes, so a blob that is the new side of one commit
+# and the old side of the next is read and split once; 0 disables it
+LINE_CACHE_SIZE = LINE_CACHE_BYTES
+
+# Rows keep both diff bodies; False keeps only the discrepancy flag and
+# leaves diff_myers and diff_histogram empty. Where git is run per file
+# (the "subprocess" backend, the slow queue and the async executor) the
+# two outputs are then compared chunk by chunk as git writes them and
+# never held in full (see stream_compare.py); the other backends diff in
+# process or per commit and drop the text once compared, and the native
+# backend does not diff files its fast path proves agree at all.
+KEEP_DIFFS = True
+
+# Each analyzed file is also diffed in-process under every algorithm of
+# SWEEP_ALGORITHMS and whitespace option of SWEEP_WHITESPACE (names from
+# sweep.WHITESPACE_OPTIONS), from the blobs the study reads anyway, and rows
+# get a "sweep" label telling which of those variants produce the same
+# patch; sweep.disagreement_matrix turns the column into pairwise counts.
+# Slow queue, log mode and async rows are left unlabeled. () disables it.
+SWEEP_ALGORITHMS = ()
+SWEEP_WHITESPACE = ("ignore", "exact")
+
+# Diff bodies are cached on disk by blob pair so reruns skip git; None disables
+DIFF_CACHE = CACHE_PATH
+
+# Rows are checkpointed every few commits so an interrupted or repeated run
+# only collects commits it has not seen yet; None keeps rows in memory
+CHECKPOINT = CHECKPOINT_DIR
+
+# "parquet" writes the dataset as one Parquet file per repository under
+# dataset/, so readers can load a few columns without the diff text;
+# "csv" writes a single dataset.csv instead. Either way rows are streamed
+# out in chunks as they are collected (see dataset_store.py).
+OUTPUT_FORMAT = "parquet"
+
+# Diff text is moved out of the rows into a compressed store holding each
+# distinct diff once (see diff_store.py); rows keep diff_myers_digest and
+# diff_histogram_digest, and DiffStore.get fetches a diff back by digest.
+# None keeps the text inline in diff_myers and diff_histogram.
+DIFF_STORE = STORE_PATH
+
+# The per-file results, without diff text, are also written to an indexed
+# SQLite table with each commit's author time, for slices such as one
+# extension of one repository over a few years (see results_db.py, whose
+# CLI and discrepancy_rates() query it, and summary.py). None skips it.
+RESULTS_DB = RESULTS_PATH
+
+# File counts by repository, file type, extension, discrepancy and commit
+# month are kept while rows are written and saved to a small CSV that
+# summary.py and visualization.py read instead of the dataset (see
+# stats_cube.py). None skips it.
+STATS_CUBE = CUBE_PATH
+
+# Changed files are vetted before diffing (see file_filter.py). Paths
+# matching SKIP_PATTERNS, files marked linguist-generated, linguist-vendored
+# or -diff in .gitattributes, binary files and files over MAX_FILE_SIZE are
+# skipped and listed with the reason in skipped_files.csv. Files over
+# SLOW_FILE_SIZE go to a slow queue at the end of each repository (or shard)
+# and are diffed by git within FILE_TIME_LIMIT seconds each. Log mode diffs
+# whole commits and is not filtered; False diffs every file.
+FILE_FILTER = True
+SKIP_PATTERNS = SKIP_GLOBS
+MAX_FILE_SIZE = MAX_FILE_BYTES
+SLOW_FILE_SIZE = SLOW_FILE_BYTES
+FILE_TIME_LIMIT = FILE_TIME_BUDGET
+
+# "enum" lists each commit's files with `git diff-tree --raw` and diffs them,
+# "traverse" does the same with pydriller's modified_files,
+# "log" reads one `git log -p` stream per algorithm and repository
+COLLECTION_MODE = "enum"
+
+# Oldest commits analyzed per repository, for a manageable dataset
+MAX_COMMITS = 1000
+
+# Commit selection, applied by git itself: revisions or ranges to walk
+# (e.g. "v1.0..main"), optional --since/--until dates and paths a commit
+# must touch. Every file of a selected commit is analyzed.
+REVISIONS = ("HEAD",)
+SINCE = None
+UNTIL = None
+PATHS = ()
+
+# Commit sampling instead of the oldest MAX_COMMITS: "random" or "stratified"
+# draw SAMPLE_SIZE selected commits (strata by STRATIFY_BY: "time", "author"
+# or "file_type"); "sequential" samples commits in random order, serially,
+# until the CONFIDENCE interval on each repository's discrepancy rate is at
+# most TARGET_CI_WIDTH wide. Samples are reproducible through SAMPLE_SEED.
+SAMPLING = None
+SAMPLE_SIZE = 1000
+SAMPLE_SEED = 0
+STRATIFY_BY = "time"
+TARGET_CI_WIDTH = 0.02
+CONFIDENCE = 0.95
+SEQUENTIAL_BATCH = 50
+
+# Worker processes for collection; 1 collects serially in this process.
+# Enum and traverse modes split each repository into shards of SHARD_COMMITS commits.
+WORKERS = os.cpu_count() or 1
+SHARD_COMMITS = 50
+
+# "sync" runs the collection selected above, "async" keeps many `git diff`
+# processes in flight from one event loop (enumerating files as in "enum"
+# mode, see async_diff.py)
+EXECUTOR = "sync"
+
+def sampled_population(repos):
+    """Digest of each repository's selected commits, which with the seed decide its sample"""
+    digests = {}
+    for repo_name, repo_path in repos:
+        shas = "\n".join(commit.sha for commit in list_commit_meta(repo_path, selection_args()))
+        digests[repo_name] = hashlib.sha1(shas.encode()).hexdigest()
+    return digests
+
+def run_settings(repos):
+    """Settings that decide which commits are collected and what their rows hold
+    
+    A checkpoint collected under other settings is started afresh. Samples
+    are drawn from the selected commits, so under SAMPLING a repository
+    whose selection changed (e.g. commits landed upstream) does too.
+    """
+    return {
+        "collection_mode": COLLECTION_MODE,
+        "executor": EXECUTOR,
+        "max_commits": MAX_COMMITS,
+        "revisions": REVISIONS,
+        "since": SINCE,
+        "until": UNTIL,
+        "paths": PATHS,
+        "sampling": SAMPLING,
+        "sample_size": SAMPLE_SIZE,
+        "sample_seed": SAMPLE_SEED,
+        "stratify_by": STRATIFY_BY,
+        "sampled_population": sampled_population(repos) if SAMPLING else None,
+        "diff_backend": DIFF_BACKEND,
+        "fast_path": FAST_PATH,
+        "keep_diffs": KEEP_DIFFS,
+        "diff_store": bool(DIFF_STORE and KEEP_DIFFS),
+        "file_filter": FILE_FILTER,
+        "skip_patterns": SKIP_PATTERNS,
+        "max_file_size": MAX_FILE_SIZE,
+        "slow_file_size": SLOW_FILE_SIZE,
+        "file_time_limit": FILE_TIME_LIMIT,
+        "sweep_algorithms": SWEEP_ALGORITHMS,
+        "sweep_whitespace": SWEEP_WHITESPACE,
+    }
+
 def get_diff(repo_dir, parent, child, path, algorithm):
     """Get git diff using specified algorithm"""
     if not parent or not path:
@@ -42,6 +228,60 @@ def get_diff(repo_dir, parent, child, path, algorithm):
     except subprocess.CalledProcessError:
         return None
 
+def make_diff_backend(pool, cache=None):
+    """Return the get_diff-compatible callable selected by DIFF_BACKEND
+    
+    Also returns the objects whose report() sums up the run.
+    """
+    reports = []
+    lines = None
+    native = None
+    if DIFF_BACKEND == "native":
+        native = NativeDiffer(pool, FAST_PATH, FAST_PATH_VERIFY, SAMPLE_SEED, LINE_CACHE_SIZE)
+        diff = native.get_diff
+        reports.append(native)
+        lines = native.lines
+        if lines is not None:
+            reports.append(lines)
+    elif DIFF_BACKEND == "pool":
+        diff = pool.get_diff
+    elif DIFF_BACKEND == "commit":
+        diff = CommitDiffer().get_diff
+    elif not KEEP_DIFFS:
+        diff = StreamComparer()
+        reports.append(diff)
+    else:
+        diff = get_diff
+    
+    if cache is not None and not isinstance(diff, StreamComparer):
+        diff = CachedDiffer(pool, cache, diff).get_diff
+        reports.append(cache)
+    if native is not None and FAST_PATH and not KEEP_DIFFS:
+        diff = FastComparer(native, diff)
+    if SWEEP_ALGORITHMS:
+        # Shares the native backend's line cache, so blobs are read once
+        diff = Sweep(pool, diff, SWEEP_ALGORITHMS, SWEEP_WHITESPACE, lines)
+        reports.append(diff)
+    return diff, reports
+
+def make_file_filter(pool, reports):
+    """The FileFilter selected by FILE_FILTER, added to reports, or None"""
+    if not FILE_FILTER or COLLECTION_MODE == "log":
+        return None
+    # Shares the native backend's line cache, so blobs are read once
+    lines = next((report for report in reports if isinstance(report, LineCache)), None)
+    file_filter = FileFilter(pool, SKIP_PATTERNS, MAX_FILE_SIZE, SLOW_FILE_SIZE, FILE_TIME_LIMIT, lines)
+    reports.append(file_filter)
+    return file_filter
+
+def open_diff_cache():
+    """The DiffCache selected by DIFF_CACHE, or a no-op context when disabled"""
+    return DiffCache(DIFF_CACHE) if DIFF_CACHE else nullcontext()
+
+def open_diff_store():
+    """The DiffStore selected by DIFF_STORE, or a no-op context when disabled or without diff text"""
+    return DiffStore(DIFF_STORE) if DIFF_STORE and KEEP_DIFFS else nullcontext()
+
 def classify_file_type(file_path):
     """Simple file type classification"""
     if not file_path:
@@ -62,81 +302,586 @@ def classify_file_type(file_path):
     else:
         return "Other"
 
-def main():
+def build_row(repo_name, commit_sha, parent, message, old_path, new_path, diff_myers, diff_histogram,
+              differs=None, sweep=None):
+    """Assemble one dataset row for a modified file
+    
+    differs, when the diffs were compared without keeping them, is the result.
+    sweep is the file's Sweep label, kept when SWEEP_ALGORITHMS is set.
+    """
+    path = new_path or old_path
+    
+    # Check if diffs are different
+    if differs is None:
+        differs = diff_myers != diff_histogram
+    discrepancy = "Yes" if differs else "No"
+    if not KEEP_DIFFS:
+        diff_myers = diff_histogram = ""
+    
+    row = {
+        "repository": repo_name,
+        "old_file_path": old_path,
+        "new_file_path": new_path,
+        "commit_sha": commit_sha,
+        "parent_commit_sha": parent,
+        "commit_message": message[:100] + "..." if len(message) > 100 else message,
+        "file_type": classify_file_type(path),
+        "file_extension": os.path.splitext(path)[1].lower() if path else "",
+        "diff_myers": diff_myers,
+        "diff_histogram": diff_histogram,
+        "discrepancy": discrepancy
+    }
+    if SWEEP_ALGORITHMS:
+        row["sweep"] = sweep or ""
+    row["skip_reason"] = ""
+    return row
+
+def skipped_row(repo_name, commit_sha, parent, message, old_path, new_path, reason):
+    """Row for a file the filter kept from being diffed, or left to the slow queue"""
+    row = build_row(repo_name, commit_sha, parent, message, old_path, new_path, "", "")
+    row["discrepancy"] = ""
+    row["skip_reason"] = reason
+    return row
+
+def selection_args():
+    """git rev-list/log arguments selecting the commits to analyze"""
+    args = []
+    if SINCE:
+        args.append(f"--since={SINCE}")
+    if UNTIL:
+        args.append(f"--until={UNTIL}")
+    args.extend(REVISIONS)
+    if PATHS:
+        args.extend(["--", *PATHS])
+    return args
+
+def count_selected(repo_path):
+    return count_commits(repo_path, selection_args(), MAX_COMMITS)
+
+def sample_commits(repo_path):
+    """Shas drawn by SAMPLING in history order, or None to take the first MAX_COMMITS"""
+    if SAMPLING not in ("random", "stratified"):
+        return None
+    
+    commits = list_commit_meta(repo_path, selection_args())
+    if SAMPLING == "random":
+        chosen = random_sample(commits, SAMPLE_SIZE, SAMPLE_SEED)
+    else:
+        keys = strata_keys(repo_path, commits, STRATIFY_BY, classify_file_type, selection_args())
+        chosen = stratified_sample(commits, keys, SAMPLE_SIZE, SAMPLE_SEED)
+    return [commit.sha for commit in chosen]
+
+def diff_both(diff, repo_dir, parent, child, path):
+    """(diff_myers, diff_histogram, differs, sweep) for one file, or None if git fails
+    
+    A StreamComparer or FastComparer backend only compares the diffs and
+    returns them empty.
+    sweep is the file's label from a Sweep backend, else None.
+    """
+    sweep = diff if isinstance(diff, Sweep) else None
+    if sweep is not None:
+        diff = sweep.diff
+    
+    if isinstance(diff, (StreamComparer, FastComparer)):
+        differs = diff.compare(repo_dir, parent, child, path)
+        if differs is None:
+            return None
+        diffs = ("", "", differs)
+    else:
+        diff_myers = diff(repo_dir, parent, child, path, "myers")
+        diff_histogram = diff(repo_dir, parent, child, path, "histogram")
+        if diff_myers is None or diff_histogram is None:
+            return None
+        diffs = (diff_myers, diff_histogram, diff_myers != diff_histogram)
+    
+    return (*diffs, sweep.label(repo_dir, parent, child, path) if sweep is not None else None)
+
+def commit_rows(repo_name, commit, diff, file_filter=None):
+    """Rows for every modified file of one pydriller commit"""
+    parents = commit.parents
+    parent = parents[0] if parents else None
+    
+    if not parent:
+        return []
+    
+    repo_dir = commit.project_path
     rows = []
     
-    for repo_name, repo_path in repositories:
-        print(f"\nAnalyzing {repo_name} repository...")
+    for file in commit.modified_files:
+        path = file.new_path or file.old_path
+        if not path:
+            continue
         
-        if not os.path.exists(repo_path):
-            print(f"Repository path {repo_path} does not exist, skipping...")
+        reason = file_filter.check(repo_dir, parent, commit.hash, path) if file_filter else None
+        if reason:
+            rows.append(skipped_row(repo_name, commit.hash, parent, commit.msg,
+                                    file.old_path, file.new_path, reason))
+            continue
+        
+        # Get diffs using both algorithms
+        diffs = diff_both(diff, repo_dir, parent, commit.hash, path)
+        if diffs is None:
             continue
         
-        repo = Repository(repo_path)
-        commits = list(repo.traverse_commits())
+        rows.append(build_row(repo_name, commit.hash, parent, commit.msg,
+                              file.old_path, file.new_path, *diffs))
+    return rows
+
+def change_rows(repo_name, repo_path, commit, changes, diff, file_filter=None):
+    """Rows for the FileChange tuples of one enumerated commit"""
+    rows = []
+    
+    for change in changes:
+        path = change.new_path or change.old_path
+        
+        reason = file_filter.check(repo_path, change.parent, change.commit, path) if file_filter else None
+        if reason:
+            rows.append(skipped_row(repo_name, change.commit, change.parent, commit.message,
+                                    change.old_path, change.new_path, reason))
+            continue
         
-        # Limit to 1000 commits for manageable dataset
-        commits = commits[:1000]
+        # Get diffs using both algorithms
+        diffs = diff_both(diff, repo_path, change.parent, change.commit, path)
+        if diffs is None:
+            continue
         
-        for commit in tqdm(commits, desc=f"Processing {repo_name} commits"):
-            parents = commit.parents
-            parent = parents[0] if parents else None
+        rows.append(build_row(repo_name, change.commit, change.parent, commit.message,
+                              change.old_path, change.new_path, *diffs))
+    return rows
+
+def log_commit_rows(repo_name, commit, commit_histogram):
+    """Rows for every changed file of one commit read from the log streams"""
+    if not commit.parents:
+        return []
+    
+    rows = []
+    for path, change in commit.changes.items():
+        old_path, new_path = change_paths(path, change)
+        rows.append(build_row(repo_name, commit.sha, commit.parents[0], commit.message.strip(),
+                              old_path, new_path,
+                              commit.patches.get(path, ""),
+                              commit_histogram.patches.get(path, "")))
+    return rows
+
+def diff_slow_row(repo_path, row, file_filter):
+    """Fill in a slow queue row with git's diffs, or None if git fails"""
+    if row["skip_reason"] != SLOW:
+        return row
+    
+    path = row["new_file_path"] or row["old_file_path"]
+    try:
+        if KEEP_DIFFS:
+            diff_myers, diff_histogram = (
+                file_filter.budget_diff(repo_path, row["parent_commit_sha"], row["commit_sha"], path, algorithm)
+                for algorithm in ("myers", "histogram")
+            )
+            differs = None if diff_myers is None or diff_histogram is None else diff_myers != diff_histogram
+        else:
+            diff_myers = diff_histogram = ""
+            differs = file_filter.budget_compare(repo_path, row["parent_commit_sha"], row["commit_sha"], path)
+    except subprocess.TimeoutExpired:
+        row["skip_reason"] = TIMEOUT
+        return row
+    
+    if differs is None:
+        return None
+    row.update(diff_myers=diff_myers, diff_histogram=diff_histogram, skip_reason="",
+               discrepancy="Yes" if differs else "No")
+    return row
+
+def drain_slow_queue(repo_path, commits, file_filter):
+    """Pass (sha, rows) pairs on, holding back commits with slow files until the rest are done"""
+    held = []
+    for sha, rows in commits:
+        if any(row["skip_reason"] == SLOW for row in rows):
+            held.append((sha, rows))
+        else:
+            yield sha, rows
+    
+    for sha, rows in held:
+        rows = [diff_slow_row(repo_path, row, file_filter) for row in rows]
+        yield sha, [row for row in rows if row is not None]
+
+def iter_repository_rows(repo_name, repo_path, diff, shas=None, open_lock=None, skip=frozenset(),
+                         file_filter=None):
+    """Yield (sha, rows) for each analyzed commit of a repository, oldest first
+    
+    Commits are streamed from git as they are analyzed, so only the current
+    one is held in memory and nothing past MAX_COMMITS is ever built.
+    Commits in skip were collected by an earlier run and are passed over.
+    With shas, only those commits are visited (not in log mode), which is
+    how a shard of a parallel run is collected. pydriller writes to
+    .git/config when it opens a repository, so shards opening the same
+    repository concurrently must hold open_lock while doing so. Commits
+    with files for file_filter's slow queue come last.
+    """
+    if COLLECTION_MODE == "log":
+        for commit, commit_histogram in iter_log_pairs(repo_path, MAX_COMMITS, selection_args()):
+            if commit.sha not in skip:
+                yield commit.sha, log_commit_rows(repo_name, commit, commit_histogram)
+        return
+    
+    commits = iter_diffed_rows(repo_name, repo_path, diff, shas, open_lock, skip, file_filter)
+    if file_filter is None:
+        yield from commits
+    else:
+        yield from drain_slow_queue(repo_path, commits, file_filter)
+
+def iter_diffed_rows(repo_name, repo_path, diff, shas, open_lock, skip, file_filter):
+    """iter_repository_rows for the enum and traverse modes, which diff file by file"""
+    if COLLECTION_MODE == "enum":
+        for commit, changes in iter_changes(repo_path, MAX_COMMITS, selection_args(), shas, skip):
+            yield commit.sha, change_rows(repo_name, repo_path, commit, changes, diff, file_filter)
+        return
+    
+    if shas is None:
+        shas = iter_commits(repo_path, MAX_COMMITS, selection_args())
+    
+    with open_lock or nullcontext():
+        git_repo = Git(repo_path)
+    try:
+        for sha in shas:
+            if sha not in skip:
+                yield sha, commit_rows(repo_name, git_repo.get_commit(sha), diff, file_filter)
+    finally:
+        git_repo.clear()
+
+def collect_serial(repos, sink):
+    """Collect repositories one commit at a time in this process"""
+    with GitDiffPool() as pool, open_diff_cache() as cache:
+        diff, reports = make_diff_backend(pool, cache)
+        file_filter = make_file_filter(pool, reports)
+        for repo_name, repo_path in repos:
+            seen = sink.seen(repo_name)
+            shas = sample_commits(repo_path)
+            if shas is None:
+                total = max(count_selected(repo_path) - len(seen), 0)
+            else:
+                total = len(set(shas) - seen)
+            commits = iter_repository_rows(repo_name, repo_path, diff, shas, skip=seen, file_filter=file_filter)
+            for sha, rows in tqdm(commits, total=total, desc=f"Processing {repo_name} commits"):
+                sink.add(repo_name, sha, rows)
+        for report in reports:
+            print(report.report())
+
+def collect_sequential(repos, sink):
+    """Sample commits in random order until each discrepancy rate is pinned down
+    
+    Batches of SEQUENTIAL_BATCH commits are collected serially, and sampling
+    of a repository stops as soon as the confidence interval on its
+    file-level discrepancy rate is at most TARGET_CI_WIDTH wide. Commits
+    collected by an earlier run count towards the estimate when the seeded
+    order reaches them, as if collected then.
+    """
+    previous = sink.load_rows(["repository", "commit_sha", "discrepancy", "skip_reason"])
+    with GitDiffPool() as pool, open_diff_cache() as cache:
+        diff, reports = make_diff_backend(pool, cache)
+        file_filter = make_file_filter(pool, reports)
+        for repo_name, repo_path in repos:
+            commits = list_commit_meta(repo_path, selection_args())
+            order = [commit.sha for commit in sequential_order(commits, SAMPLE_SEED)]
+            estimate = RateEstimate(len(commits), CONFIDENCE)
+            seen = sink.seen(repo_name)
             
-            if not parent:
-                continue
+            # (files, discrepancies) of each commit collected by an earlier run
+            prior = {}
+            if seen and not previous.empty:
+                repo_rows = previous[previous["repository"] == repo_name]
+                for sha, group in repo_rows.groupby("commit_sha"):
+                    diffed = group[group["skip_reason"] == ""]
+                    prior[sha] = (len(diffed), int((diffed["discrepancy"] == "Yes").sum()))
             
-            repo_dir = commit.project_path
+            with tqdm(total=len(order), desc=f"Sampling {repo_name} commits") as bar:
+                for start in range(0, len(order), SEQUENTIAL_BATCH):
+                    if 2 * estimate.half_width() <= TARGET_CI_WIDTH:
+                        break
+                    batch = order[start:start + SEQUENTIAL_BATCH]
+                    for sha in batch:
+                        if sha in seen:
+                            # Commits without rows were recorded with none
+                            estimate.add(*prior.get(sha, (0, 0)))
+                            bar.update(1)
+                    batch_rows = iter_repository_rows(repo_name, repo_path, diff, batch, skip=seen,
+                                                      file_filter=file_filter)
+                    for sha, rows in batch_rows:
+                        sink.add(repo_name, sha, rows)
+                        diffed = [row for row in rows if not row["skip_reason"]]
+                        estimate.add(len(diffed), sum(row["discrepancy"] == "Yes" for row in diffed))
+                        bar.update(1)
             
-            for file in commit.modified_files:
-                path = file.new_path or file.old_path
-                if not path:
-                    continue
-                
-                # Get diffs using both algorithms
-                diff_myers = get_diff(repo_dir, parent, commit.hash, path, "myers")
-                diff_histogram = get_diff(repo_dir, parent, commit.hash, path, "histogram")
-                
-                if diff_myers is None or diff_histogram is None:
-                    continue
-                
-                # Check if diffs are different
-                discrepancy = "Yes" if diff_myers != diff_histogram else "No"
+            print(f"  {repo_name}: discrepancy rate {estimate.rate() * 100:.2f}% "
+                  f"± {estimate.half_width() * 100:.2f}% ({CONFIDENCE:.0%} CI) "
+                  f"from {len(estimate.clusters):,} of {len(commits):,} commits")
+        for report in reports:
+            print(report.report())
+
+def collect_shard(repo_name, repo_path, shas, skip, progress, open_lock):
+    """Collect the (sha, rows) pairs of one (repository, commits) shard in a worker process
+    
+    Each finished commit is reported on the progress queue so the parent can
+    advance the repository's progress bar while the shard is still running.
+    Also returns the counters() of the shard's report objects.
+    """
+    results = []
+    with GitDiffPool() as pool, open_diff_cache() as cache:
+        diff, reports = make_diff_backend(pool, cache)
+        file_filter = make_file_filter(pool, reports)
+        for sha, rows in iter_repository_rows(repo_name, repo_path, diff, shas, open_lock, skip, file_filter):
+            results.append((sha, rows))
+            progress.put(repo_name)
+        return results, [report.counters() for report in reports]
+
+def plan_shards(repos, sink):
+    """Split the unseen commits of each repository into ranges of SHARD_COMMITS
+    
+    A `git log -p` stream cannot be split, so log mode gets one shard per
+    repository. Returns the shards in dataset order and the commit total
+    per repository.
+    """
+    shards = []
+    totals = {}
+    for repo_name, repo_path in repos:
+        seen = sink.seen(repo_name)
+        if COLLECTION_MODE == "log":
+            totals[repo_name] = max(count_selected(repo_path) - len(seen), 0)
+            shards.append((repo_name, repo_path, None, seen))
+            continue
+        
+        shas = sample_commits(repo_path)
+        if shas is None:
+            shas = list_commits(repo_path, MAX_COMMITS, selection_args())
+        shas = [sha for sha in shas if sha not in seen]
+        totals[repo_name] = len(shas)
+        for start in range(0, len(shas), SHARD_COMMITS):
+            shards.append((repo_name, repo_path, shas[start:start + SHARD_COMMITS], frozenset()))
+    return shards, totals
+
+def collect_parallel(repos, workers, sink):
+    """Collect all repositories on a process pool
+    
+    Shards finish in any order, but each is handed to the sink only once all
+    shards before it are done, so rows arrive in the same order as a serial
+    run and completed prefixes are checkpointed while later shards run.
+    The shards' report counters are summed into report objects built here.
+    """
+    shards, totals = plan_shards(repos, sink)
+    bars = {
+        repo_name: tqdm(total=total, desc=f"Processing {repo_name} commits", position=i)
+        for i, (repo_name, total) in enumerate(totals.items())
+    }
+    
+    with Manager() as manager, ProcessPoolExecutor(max_workers=workers) as executor:
+        progress = manager.Queue()
+        open_lock = manager.Lock()
+        futures = [executor.submit(collect_shard, *shard, progress, open_lock) for shard in shards]
+        
+        merged = 0
+        shard_counters = []
+        while merged < len(futures):
+            wait(futures[merged:], timeout=0.2)
+            while not progress.empty():
+                bars[progress.get()].update(1)
+            while merged < len(futures) and futures[merged].done():
+                repo_name = shards[merged][0]
+                results, counters = futures[merged].result()
+                for sha, rows in results:
+                    sink.add(repo_name, sha, rows)
+                shard_counters.append(counters)
+                merged += 1
+    
+    for bar in bars.values():
+        bar.close()
+    
+    # Every shard built the same backend, so its counters line up with these
+    with GitDiffPool() as pool, open_diff_cache() as cache:
+        _, reports = make_diff_backend(pool, cache)
+        make_file_filter(pool, reports)
+        for counters in shard_counters:
+            for report, values in zip(reports, counters):
+                report.merge(values)
+        for report in reports:
+            print(report.report())
+
+async def change_rows_async(repo_name, repo_path, commit, changes, differ, file_filter=None):
+    """Async counterpart of change_rows, diffing all files of a commit concurrently
+    
+    Slow queue files are diffed along with the rest, since every call
+    already runs under the AsyncDiffer timeout.
+    """
+    reasons = []
+    for change in changes:
+        reason = None
+        if file_filter:
+            reason = file_filter.check(repo_path, change.parent, change.commit, change.new_path or change.old_path)
+        reasons.append(None if reason == SLOW else reason)
+    
+    diffed = [i for i, reason in enumerate(reasons) if reason is None]
+    if KEEP_DIFFS:
+        diffs = await gather_in_order(
+            differ.get_diff(repo_path, changes[i].parent, changes[i].commit,
+                            changes[i].new_path or changes[i].old_path, algorithm)
+            for i in diffed
+            for algorithm in ("myers", "histogram")
+        )
+        results = {}
+        for i, diff_myers, diff_histogram in zip(diffed, diffs[::2], diffs[1::2]):
+            failed = diff_myers is None or diff_histogram is None
+            results[i] = (diff_myers, diff_histogram, None if failed else diff_myers != diff_histogram)
+    else:
+        flags = await gather_in_order(
+            differ.compare(repo_path, changes[i].parent, changes[i].commit,
+                           changes[i].new_path or changes[i].old_path)
+            for i in diffed
+        )
+        results = {i: ("", "", differs) for i, differs in zip(diffed, flags)}
+    
+    rows = []
+    for i, change in enumerate(changes):
+        if reasons[i]:
+            rows.append(skipped_row(repo_name, change.commit, change.parent, commit.message,
+                                    change.old_path, change.new_path, reasons[i]))
+            continue
+        diff_myers, diff_histogram, differs = results[i]
+        if differs is None:
+            continue
+        rows.append(build_row(repo_name, change.commit, change.parent, commit.message,
+                              change.old_path, change.new_path, diff_myers, diff_histogram, differs))
+    return rows
+
+async def collect_async(repos, sink):
+    """Collect all repositories with git diffs issued as asyncio subprocesses
+    
+    Files are enumerated with `git diff-tree --raw` (see tree_changes.py)
+    in a worker thread, then every file diff of every commit is in flight
+    at once, bounded by the AsyncDiffer semaphore.
+    """
+    differ = AsyncDiffer()
+    reports = []
+    with GitDiffPool() as pool:
+        file_filter = make_file_filter(pool, reports)
+        
+        for repo_name, repo_path in repos:
+            seen = sink.seen(repo_name)
+            shas = sample_commits(repo_path)
+            work = await asyncio.to_thread(
+                lambda: list(iter_changes(repo_path, MAX_COMMITS, selection_args(), shas, seen)))
+            added = [asyncio.Event() for _ in work]
+            
+            with tqdm(total=len(work), desc=f"Processing {repo_name} commits") as bar:
+                async def commit_task(index):
+                    commit, changes = work[index]
+                    rows = await change_rows_async(repo_name, repo_path, commit, changes, differ, file_filter)
+                    bar.update(1)
+                    
+                    # Hand rows over in commit order, so checkpoints hold complete prefixes
+                    if index:
+                        await added[index - 1].wait()
+                    sink.add(repo_name, commit.sha, rows)
+                    added[index].set()
                 
-                rows.append({
-                    "repository": repo_name,
-                    "old_file_path": file.old_path,
-                    "new_file_path": file.new_path,
-                    "commit_sha": commit.hash,
-                    "parent_commit_sha": parent,
-                    "commit_message": commit.msg[:100] + "..." if len(commit.msg) > 100 else commit.msg,
-                    "file_type": classify_file_type(path),
-                    "file_extension": os.path.splitext(path)[1].lower() if path else "",
-                    "diff_myers": diff_myers,
-                    "diff_histogram": diff_histogram,
-                    "discrepancy": discrepancy
-                })
-    
-    # Create DataFrame and save
-    df = pd.DataFrame(rows)
-    df.to_csv("dataset.csv", index=False)
+                await gather_in_order(map(commit_task, range(len(work))))
+    
+    for report in reports:
+        print(report.report())
+    if differ.timeouts:
+        print(f"{differ.timeouts:,} git diff calls timed out and were skipped")
+
+def main():
+    repos = []
+    
+    for repo_name, repo_path in repositories:
+        print(f"\nAnalyzing {repo_name} repository...")
+        
+        if not os.path.exists(repo_path):
+            print(f"Repository path {repo_path} does not exist, skipping...")
+            continue
+        
+        repos.append((repo_name, repo_path))
+    
+    if SAMPLING and COLLECTION_MODE == "log":
+        raise ValueError("sampling needs COLLECTION_MODE 'enum' or 'traverse'")
+    if SAMPLING == "sequential" and EXECUTOR == "async":
+        raise ValueError("sequential sampling collects in batches and needs EXECUTOR 'sync'")
+    if SAMPLING == "sequential" and WORKERS > 1:
+        print(f"Sequential sampling collects one batch at a time; WORKERS={WORKERS} does not apply")
+    
+    paths = dict(repos)
+    
+    @lru_cache(maxsize=None)
+    def commit_times(repo_name):
+        if repo_name not in paths:
+            return {}
+        return {commit.sha: commit.timestamp for commit in list_commit_meta(paths[repo_name], REVISIONS)}
+    
+    @lru_cache(maxsize=None)
+    def positions(repo_name):
+        return commit_positions(paths[repo_name], selection_args())
+    
+    def selected(rows):
+        """Checkpointed rows of commits the current selection still yields"""
+        keep = [repo_name in paths and sha in positions(repo_name)
+                for repo_name, sha in zip(rows["repository"], rows["commit_sha"])]
+        return rows[keep]
+    
+    results = ResultsWriter(commit_times, RESULTS_DB) if RESULTS_DB else None
+    cube = StatsCube(commit_times, STATS_CUBE) if STATS_CUBE else None
+    with DatasetWriter(OUTPUT_FORMAT, results=results, cube=cube) as writer:
+        with Checkpoint(CHECKPOINT, settings=run_settings(repos)) if CHECKPOINT else StreamRows(writer) as sink, \
+                open_diff_store() as store:
+            checkpoint = sink if CHECKPOINT else None
+            if store is not None:
+                sink = DigestRows(sink, store)
+            
+            if SAMPLING == "sequential":
+                collect_sequential(repos, sink)
+            elif EXECUTOR == "async":
+                asyncio.run(collect_async(repos, sink))
+            elif WORKERS > 1:
+                collect_parallel(repos, WORKERS, sink)
+            else:
+                collect_serial(repos, sink)
+            if store is not None:
+                print(store.report())
+            
+            # Rows of earlier runs are streamed out of the checkpoint in chunks,
+            # leaving out commits no longer selected (e.g. rewritten upstream)
+            if checkpoint is not None:
+                for chunk in checkpoint.iter_rows():
+                    writer.write(selected(chunk))
+        
+        # Commits that landed upstream since the last run are appended at the
+        # end, and commits held back for the slow queue come last, so those
+        # repositories are put back in history order
+        writer.close(positions if CHECKPOINT or FILE_FILTER else None)
+    
+    summary = writer.summary
+    total_files = sum(summary.files.values())
+    total_disagreements = sum(summary.disagreements.values())
+    total_skipped = sum(summary.skipped.values())
     
     # Print summary
     print(f"\n{'='*60}")
     print("ANALYSIS COMPLETE")
     print(f"{'='*60}")
-    print(f"Total files analyzed: {len(df):,}")
-    print(f"Algorithm disagreements: {len(df[df['discrepancy'] == 'Yes']):,}")
-    print(f"Agreement rate: {len(df[df['discrepancy'] == 'No']) / len(df) * 100:.2f}%")
+    print(f"Total files analyzed: {total_files:,}")
+    if total_skipped:
+        print(f"Files skipped before diffing: {total_skipped:,} (listed in '{writer.skipped_path}')")
+    print(f"Algorithm disagreements: {total_disagreements:,}")
+    print(f"Agreement rate: {(total_files - total_disagreements) / total_files * 100:.2f}%")
     
     print("\nRepository breakdown:")
     for repo_name, _ in repositories:
-        repo_df = df[df['repository'] == repo_name]
-        if len(repo_df) > 0:
-            disagreements = len(repo_df[repo_df['discrepancy'] == 'Yes'])
-            print(f"  {repo_name}: {disagreements:,}/{len(repo_df):,} disagreements ({disagreements/len(repo_df)*100:.2f}%)")
+        files = summary.files[repo_name]
+        if files > 0:
+            disagreements = summary.disagreements[repo_name]
+            print(f"  {repo_name}: {disagreements:,}/{files:,} disagreements ({disagreements/files*100:.2f}%)")
     
-    print(f"\nDataset saved as 'dataset.csv'")
-    return df
+    print(f"\nDataset saved as '{writer.path}'")
+    if results is not None:
+        print(f"Results database saved as '{results.path}' ({results.rows:,} files)")
+    if cube is not None:
+        print(f"Statistics cube saved as '{cube.path}' ({len(cube.cells):,} cells)")
+    return summary
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,88 @@
+"""
+Statistics Cube
+File counts by repository, file type, extension, discrepancy and month, kept while collecting
+"""
+
+import os
+import time
+from collections import Counter
+
+import pandas as pd
+
+from dataset_store import dataset_mtime, load_dataset
+from results_db import RESULTS_PATH, discrepancy_rates
+
+CUBE_PATH = "stats_cube.csv"
+
+CUBE_COLUMNS = ["repository", "file_type", "file_extension", "discrepancy", "month"]
+
+# Time bucket of a commit, from its author time (UTC)
+MONTH_FORMAT = "%Y-%m"
+
+
+class StatsCube:
+    """Counts of analyzed files per cell of CUBE_COLUMNS, saved as a small CSV
+
+    Cells are counted as rows are written and the file is replaced on
+    save(). Its size depends on the number of distinct cells, not of files,
+    so reports built on it load instantly. commit_times(repo_name) gives
+    {sha: unix author time} for a repository; files of commits it does not
+    know get an empty month.
+    """
+
+    def __init__(self, commit_times, path=CUBE_PATH):
+        self.commit_times = commit_times
+        self.months = {}
+        self.path = path
+        self.cells = Counter()
+
+    def month(self, repo_name, sha):
+        if repo_name not in self.months:
+            self.months[repo_name] = {
+                sha: time.strftime(MONTH_FORMAT, time.gmtime(timestamp))
+                for sha, timestamp in self.commit_times(repo_name).items()
+            }
+        return self.months[repo_name].get(sha, "")
+
+    def add(self, row):
+        self.cells[(row["repository"], row["file_type"], row["file_extension"], row["discrepancy"],
+                    self.month(row["repository"], row["commit_sha"]))] += 1
+
+    def save(self):
+        df = pd.DataFrame([(*cell, files) for cell, files in self.cells.items()],
+                          columns=[*CUBE_COLUMNS, "files"])
+        df.sort_values(CUBE_COLUMNS).to_csv(self.path + ".tmp", index=False)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def read_cube(path=CUBE_PATH):
+    return pd.read_csv(path, dtype={column: str for column in CUBE_COLUMNS}, keep_default_na=False)
+
+
+def fresh(path):
+    """Whether a sidecar exists and was written along with the current dataset"""
+    return os.path.exists(path) and os.path.getmtime(path) >= dataset_mtime()
+
+
+def load_counts(by=("repository", "file_type")):
+    """Files, discrepancies and discrepancy rate (%) per value of the `by` columns
+
+    Summed from the statistics cube when it is fresh, else counted by
+    results.sqlite, else from the dataset itself. by names columns of
+    CUBE_COLUMNS; "month" needs the cube or the database.
+    """
+    by = list(by)
+    if fresh(CUBE_PATH):
+        cube = read_cube()
+        cube["discrepancies"] = cube["files"].where(cube["discrepancy"] == "Yes", 0)
+        counts = cube.groupby(by)[["files", "discrepancies"]].sum().reset_index()
+    elif fresh(RESULTS_PATH):
+        return discrepancy_rates(by)
+    else:
+        df = load_dataset([*by, "discrepancy"])
+        counts = (df.groupby(by, observed=True)["discrepancy"]
+                    .agg(files="size", discrepancies="sum")
+                    .reset_index()
+                    .astype({column: str for column in by}))
+    counts["rate"] = counts["discrepancies"] / counts["files"] * 100
+    return counts
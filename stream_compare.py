@@ -0,0 +1,114 @@
+"""
+Streaming Diff Comparison
+Decides whether git's Myers and histogram diffs of a file differ without holding either in full
+"""
+
+import subprocess
+import threading
+
+# Bytes read from each git process per comparison step
+CHUNK_BYTES = 64 * 1024
+
+
+def diff_command(parent, child, path, algorithm):
+    """The `git diff` command line simple_analysis.get_diff runs"""
+    return [
+        "git", "diff",
+        "-w",
+        "--ignore-blank-lines",
+        f"--diff-algorithm={algorithm}",
+        parent,
+        child,
+        "--",
+        path
+    ]
+
+
+class StreamComparer:
+    """Compares the two diffs of a file chunk by chunk, as git writes them
+
+    Both git processes run at once and are read CHUNK_BYTES at a time; at
+    the first chunk that differs both are killed, so a large diff that
+    disagrees early is never read to the end, and no output is decoded.
+    With a timeout, a comparison taking longer raises
+    subprocess.TimeoutExpired.
+    """
+
+    def __init__(self, chunk_bytes=CHUNK_BYTES, timeout=None):
+        self.chunk_bytes = chunk_bytes
+        self.timeout = timeout
+        self.compared = 0
+        self.differing = 0
+        self.stopped_early = 0
+        self.bytes_read = 0
+
+    def compare(self, repo_dir, parent, child, path):
+        """True if the diffs differ, False if they are identical, None if git fails"""
+        if not parent or not path:
+            return None
+
+        processes = [
+            subprocess.Popen(diff_command(parent, child, path, algorithm), cwd=repo_dir,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for algorithm in ("myers", "histogram")
+        ]
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            for process in processes:
+                process.kill()
+
+        timer = threading.Timer(self.timeout, expire) if self.timeout is not None else None
+        if timer is not None:
+            timer.start()
+        try:
+            differs = self._compare_streams(processes)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            stopped = False
+            for process in processes:
+                if process.poll() is None:
+                    stopped = True
+                    process.kill()
+                process.wait()
+                process.stdout.close()
+
+        if expired.is_set():
+            raise subprocess.TimeoutExpired(diff_command(parent, child, path, "myers"), self.timeout)
+        self.compared += 1
+        if differs:
+            self.differing += 1
+            self.stopped_early += stopped
+            return True
+        if any(process.returncode for process in processes):
+            return None
+        return False
+
+    def _compare_streams(self, processes):
+        """True at the first differing chunk, False once both streams end together"""
+        while True:
+            chunks = [process.stdout.read(self.chunk_bytes) for process in processes]
+            self.bytes_read += sum(len(chunk) for chunk in chunks)
+            if chunks[0] != chunks[1]:
+                return True
+            if not chunks[0]:
+                return False
+
+    def counters(self):
+        """What report() sums up, as plain values a worker process can return"""
+        return {"compared": self.compared, "differing": self.differing,
+                "stopped_early": self.stopped_early, "bytes_read": self.bytes_read}
+
+    def merge(self, counters):
+        """Add the counters() of a StreamComparer in another process"""
+        self.compared += counters["compared"]
+        self.differing += counters["differing"]
+        self.stopped_early += counters["stopped_early"]
+        self.bytes_read += counters["bytes_read"]
+
+    def report(self):
+        return (f"Streaming comparison: {self.compared:,} files, {self.differing:,} differing "
+                f"({self.stopped_early:,} stopped before git finished), "
+                f"{self.bytes_read / 1024 ** 2:,.1f} MB of diff output read")
@@ -3,17 +3,18 @@ Summary Statistics
 Quick summary of the diff algorithm analysis results
 """
 
-import pandas as pd
 import matplotlib.pyplot as plt
 
+from stats_cube import load_counts
+
 def display_summary():
     """Display summary statistics from the analysis."""
     
-    # Load the comprehensive dataset
+    # Load the per-repository, per-file-type counts (from the statistics cube when there is one)
     try:
-        df = pd.read_csv('dataset.csv')
+        counts = load_counts()
     except FileNotFoundError:
-        print("Error: dataset.csv not found")
+        print("Error: neither dataset/ nor dataset.csv found")
         print("Please run diff_analysis.py first")
         return
     
@@ -22,8 +23,8 @@ def display_summary():
     print("=" * 60)
     
     # Overall statistics
-    total_files = len(df)
-    total_discrepancies = len(df[df['discrepancy'] == 'Yes'])
+    total_files = counts['files'].sum()
+    total_discrepancies = counts['discrepancies'].sum()
     discrepancy_rate = (total_discrepancies / total_files) * 100
     
     print(f"\nOVERALL RESULTS:")
@@ -33,10 +34,8 @@ def display_summary():
     
     # Repository breakdown
     print(f"\nREPOSITORY BREAKDOWN:")
-    repo_stats = df.groupby('repository').agg({
-        'discrepancy': lambda x: (x == 'Yes').sum(),
-        'file_type': 'count'
-    }).rename(columns={'discrepancy': 'discrepancies', 'file_type': 'total_files'})
+    repo_stats = counts.groupby('repository')[['discrepancies', 'files']].sum().rename(
+        columns={'files': 'total_files'})
     
     repo_stats['rate'] = (repo_stats['discrepancies'] / repo_stats['total_files']) * 100
     
@@ -48,8 +47,8 @@ def display_summary():
     
     # File type breakdown
     print(f"\nFILE TYPE ANALYSIS:")
-    file_type_discrepancies = df[df['discrepancy'] == 'Yes'].groupby('file_type').size()
-    file_type_totals = df.groupby('file_type').size()
+    file_type_discrepancies = counts.groupby('file_type')['discrepancies'].sum()
+    file_type_totals = counts.groupby('file_type')['files'].sum()
     
     for file_type in file_type_totals.index:
         discrepancies = file_type_discrepancies.get(file_type, 0)
@@ -0,0 +1,144 @@
+"""
+Diff Sweep
+Diffs each changed file under several algorithms and whitespace options from a single read of its blobs
+"""
+
+from collections import Counter
+from itertools import combinations
+
+import pandas as pd
+
+from native_diff import SUPPORTED_ALGORITHMS, DiffInput, LineCache, diff_body
+
+# Algorithms diffed for every file when the sweep is on
+SWEEP_ALGORITHMS = ("myers", "minimal", "patience", "histogram")
+
+# Whitespace options by name: (ignore_space, ignore_blank_lines) and the git
+# flags they reproduce. "ignore" is what the study's get_diff runs with.
+WHITESPACE_OPTIONS = {
+    "ignore": (True, True, ("-w", "--ignore-blank-lines")),
+    "space": (True, False, ("-w",)),
+    "blank": (False, True, ("--ignore-blank-lines",)),
+    "exact": (False, False, ()),
+}
+SWEEP_WHITESPACE = ("ignore", "exact")
+
+
+def variant_name(algorithm, whitespace):
+    return f"{algorithm}/{whitespace}"
+
+
+class Sweep:
+    """get_diff-compatible wrapper that also diffs each file under a matrix of variants
+
+    Calls go to diff unchanged; label() diffs one file under every
+    algorithm × whitespace option in-process. The changed paths come from
+    the pool's `git diff-tree` worker, which already holds the commit's
+    answer, and the blobs from lines, the native backend's LineCache when
+    it has one, so a sweep reads nothing from git that the study does not,
+    and adding variants only adds diff computation.
+
+    A label holds, per variant in the order of variants, the index of the
+    first variant whose patch is identical: "0,0,2,0" means the third
+    variant alone differs. Any pairwise comparison follows from it (see
+    pairwise and disagreement_matrix).
+    """
+
+    def __init__(self, pool, diff, algorithms=SWEEP_ALGORITHMS, whitespace=SWEEP_WHITESPACE, lines=None):
+        for algorithm in algorithms:
+            if algorithm not in SUPPORTED_ALGORITHMS:
+                raise ValueError(f"unsupported diff algorithm: {algorithm}")
+        for option in whitespace:
+            if option not in WHITESPACE_OPTIONS:
+                raise ValueError(f"unknown whitespace option: {option}")
+        self.pool = pool
+        self.diff = diff
+        self.algorithms = tuple(algorithms)
+        self.whitespace = tuple(whitespace)
+        self.variants = [variant_name(algorithm, option) for option in self.whitespace for algorithm in self.algorithms]
+        self.lines = lines if lines is not None else LineCache()
+        self.files = 0
+        self.unlabeled = 0
+        self.disagreements = Counter()
+
+    def __call__(self, repo_dir, parent, child, path, algorithm):
+        return self.diff(repo_dir, parent, child, path, algorithm)
+
+    def label(self, repo_dir, parent, child, path):
+        """Equivalence label of a file's patches over all variants, or "" if it cannot be diffed here
+
+        Submodules, type changes, paths git diffs its own way (see
+        GitAttributeReader.git_diffs) and unreadable blobs are left unlabeled.
+        """
+        if not parent or not path:
+            return ""
+        changes = self.pool.tree_worker(repo_dir).get_file_diffs(parent, child)
+        change = changes.get(path) if changes is not None else None
+        if (change is None or change.status not in ("A", "M", "D")
+                or "160000" in (change.old_mode, change.new_mode)
+                or self.pool.attribute_reader(repo_dir).git_diffs(path)):
+            self.unlabeled += 1
+            return ""
+
+        reader = self.pool.blob_reader(repo_dir)
+
+        def read(key):
+            return reader.read(key[1])
+
+        old = self.lines.get((repo_dir, change.old_id), read)
+        new = self.lines.get((repo_dir, change.new_id), read)
+        if old is None or new is None:
+            self.unlabeled += 1
+            return ""
+
+        bodies = []
+        for option in self.whitespace:
+            ignore_space, ignore_blank_lines, _ = WHITESPACE_OPTIONS[option]
+            inp = DiffInput.from_lines(old, new, ignore_space, ignore_blank_lines)
+            bodies.extend(diff_body(inp, algorithm) for algorithm in self.algorithms)
+
+        classes = [bodies.index(body) for body in bodies]
+        self.files += 1
+        for (i, a), (j, b) in combinations(enumerate(classes), 2):
+            if a != b:
+                self.disagreements[i, j] += 1
+        return ",".join(map(str, classes))
+
+    def counters(self):
+        """What report() sums up, as plain values a worker process can return"""
+        return {"files": self.files, "unlabeled": self.unlabeled, "disagreements": self.disagreements}
+
+    def merge(self, counters):
+        """Add the counters() of a Sweep in another process"""
+        self.files += counters["files"]
+        self.unlabeled += counters["unlabeled"]
+        self.disagreements.update(counters["disagreements"])
+
+    def report(self):
+        lines = [f"Sweep: {self.files:,} files diffed under {len(self.variants)} variants"
+                 + (f", {self.unlabeled:,} left to git unlabeled" if self.unlabeled else "")]
+        for (i, j), count in sorted(self.disagreements.items()):
+            lines.append(f"  {self.variants[i]} vs {self.variants[j]}: {count:,} files differ "
+                         f"({count / self.files * 100:.2f}%)")
+        return "\n".join(lines)
+
+
+def pairwise(label):
+    """Whether each pair of variants of a labeled file differs, as {(i, j): bool}"""
+    classes = label.split(",")
+    return {(i, j): classes[i] != classes[j] for i, j in combinations(range(len(classes)), 2)}
+
+
+def disagreement_matrix(labels, variants):
+    """Files whose patches differ for each pair of variants, over the non-empty labels
+
+    labels is the dataset's sweep column and variants the Sweep.variants
+    it was collected with.
+    """
+    matrix = pd.DataFrame(0, index=variants, columns=variants)
+    for label, files in Counter(label for label in labels if label).items():
+        for (i, j), differs in pairwise(label).items():
+            if differs:
+                matrix.iloc[i, j] += files
+                matrix.iloc[j, i] += files
+    return matrix
@@ -0,0 +1,152 @@
+"""
+Tree Change Enumerator
+Commits and their changed files from `git log` and `git diff-tree --raw`, without patch text
+"""
+
+import subprocess
+from collections import namedtuple
+
+from git_pool import SENTINEL, GitDiffWorker, is_null_id
+
+# One changed file of a commit against its first parent; absent sides are None
+FileChange = namedtuple("FileChange", "commit parent old_path new_path old_blob new_blob status")
+
+CommitInfo = namedtuple("CommitInfo", "sha parents message")
+
+READ_SIZE = 1 << 16
+
+
+def iter_nul_records(stream):
+    """Yield the NUL-terminated records of a binary stream as they arrive"""
+    pending = b""
+    while True:
+        chunk = stream.read1(READ_SIZE)
+        if not chunk:
+            break
+        records = (pending + chunk).split(b"\0")
+        pending = records.pop()
+        yield from records
+    if pending:
+        yield pending
+
+
+def iter_commit_info(repo_dir, max_commits=None, revisions=("HEAD",), shas=None):
+    """Yield CommitInfo oldest first from `git log -z`, stopping git after max_commits
+
+    With shas, exactly those commits are described, in the given order.
+    """
+    if shas is None:
+        selection = ["--reverse", *revisions]
+    else:
+        selection = ["--no-walk=unsorted", "--stdin"]
+    process = subprocess.Popen(
+        ["git", "log", "-z", "--format=%H %P%n%B", *selection],
+        cwd=repo_dir,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        # git reads all of stdin before walking, so this cannot block on stdout
+        process.stdin.write("".join(f"{sha}\n" for sha in shas or ()).encode())
+        process.stdin.close()
+        for count, record in enumerate(iter_nul_records(process.stdout)):
+            if max_commits is not None and count >= max_commits:
+                break
+            header, _, message = record.decode("utf-8", errors="replace").partition("\n")
+            ids = header.split()
+            yield CommitInfo(ids[0], ids[1:], message.strip())
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+
+
+def parse_raw_z(data):
+    """Parse `--raw -z` output into (status, old_mode, new_mode, old_blob, new_blob, old_path, new_path)"""
+    fields = data.split(b"\0")
+    entries = []
+    i = 0
+    while i < len(fields) and fields[i].startswith(b":"):
+        old_mode, new_mode, old_blob, new_blob, status = fields[i][1:].decode().split()
+        old_path = fields[i + 1].decode("utf-8", errors="replace")
+        # Renames and copies carry the source path first, then the destination
+        if status[0] in "RC":
+            new_path = fields[i + 2].decode("utf-8", errors="replace")
+            i += 3
+        else:
+            new_path = old_path
+            i += 2
+        entries.append((status, old_mode, new_mode, old_blob, new_blob, old_path, new_path))
+    return entries
+
+
+class GitChangeWorker(GitDiffWorker):
+    """A `git diff-tree --stdin -r -z --raw -M` process listing the files a commit changed
+
+    Renames are detected the way pydriller (through GitPython) reports them.
+    With -z the echoed sentinel directly follows the last NUL instead of
+    starting a line of its own.
+    """
+
+    def __init__(self, repo_dir):
+        super().__init__(repo_dir, None)
+
+    def command(self):
+        return ["git", "diff-tree", "--stdin", "--no-commit-id", "-r", "-z", "--raw", "-M"]
+
+    def read_lines(self):
+        end = SENTINEL + b"\n"
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                self.close()
+                return
+            if line.endswith(end) and (len(line) == len(end) or line[-len(end) - 1] == 0):
+                yield line[:-len(end)]
+                return
+            yield line
+
+    def parse(self, lines):
+        return parse_raw_z(b"".join(lines))
+
+
+def commit_changes(worker, commit):
+    """FileChange tuples of one commit against its first parent
+
+    Root and merge commits yield nothing, matching pydriller's
+    modified_files, whose rows the collector skips.
+    """
+    if len(commit.parents) != 1:
+        return []
+
+    parent = commit.parents[0]
+    entries = worker.get_file_diffs(parent, commit.sha)
+    if entries is None:
+        return []
+
+    changes = []
+    for status, old_mode, new_mode, old_blob, new_blob, old_path, new_path in entries:
+        changes.append(FileChange(
+            commit.sha, parent,
+            None if is_null_id(old_mode) else old_path,
+            None if is_null_id(new_mode) else new_path,
+            None if is_null_id(old_blob) else old_blob,
+            None if is_null_id(new_blob) else new_blob,
+            status[0]
+        ))
+    return changes
+
+
+def iter_changes(repo_dir, max_commits=None, revisions=("HEAD",), shas=None, skip=frozenset()):
+    """Yield (CommitInfo, [FileChange]) for each selected commit, oldest first
+
+    Commits in skip are passed over before their files are listed.
+    """
+    worker = GitChangeWorker(repo_dir)
+    try:
+        for commit in iter_commit_info(repo_dir, max_commits, revisions, shas):
+            if commit.sha not in skip:
+                yield commit, commit_changes(worker, commit)
+    finally:
+        worker.close()
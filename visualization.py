@@ -8,13 +8,45 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 
+from stats_cube import load_counts
+
+# File types with fewer files are left out of the file type panel
+MIN_FILE_TYPE_FILES = 10
+
+def panel_stats(counts):
+    """Totals, disagreements and rates per repository and per file type
+    
+    counts holds files and discrepancies per repository and file type. They
+    are pivoted into one repository x file type grid in a single pass; the
+    per-repository and per-file-type figures are its row and column sums.
+    """
+    grid = counts.pivot_table(index='repository', columns='file_type',
+                              values=['files', 'discrepancies'], aggfunc='sum', fill_value=0)
+    
+    def rates(axis):
+        stats = pd.DataFrame({'total': grid['files'].sum(axis=axis),
+                              'disagreements': grid['discrepancies'].sum(axis=axis)})
+        stats['rate'] = stats['disagreements'] / stats['total'].where(stats['total'] > 0) * 100
+        stats['rate'] = stats['rate'].fillna(0)
+        return stats
+    
+    repo_stats = rates(axis=1)
+    ft_stats = rates(axis=0)
+    ft_stats = ft_stats[ft_stats['total'] >= MIN_FILE_TYPE_FILES]
+    return repo_stats, ft_stats
+
 def create_final_clear_visualization():
     """Create the clearest possible visualization from the dataset."""
     
-    # Read the dataset
+    # Read the per-repository, per-file-type counts (from the statistics cube when there is one)
     print("Loading dataset...")
-    df = pd.read_csv('dataset.csv')
-    print(f"Loaded {len(df):,} records")
+    counts = load_counts()
+    print(f"Loaded {counts['files'].sum():,} records")
+    
+    # Every statistic the panels and the summary text need, in one pass
+    repo_stats, ft_stats = panel_stats(counts)
+    total_files = repo_stats['total'].sum()
+    total_disagreements = repo_stats['disagreements'].sum()
     
     # Set professional, formal style
     plt.style.use('classic')
@@ -35,9 +67,8 @@ def create_final_clear_visualization():
                 fontsize=18, fontweight='bold', y=0.96)
     
     # Plot 1: Overall Agreement - Simple and Clear
-    discrepancy_counts = df['discrepancy'].value_counts()
-    agreement_count = discrepancy_counts.get('No', 0)
-    disagreement_count = discrepancy_counts.get('Yes', 0)
+    disagreement_count = total_disagreements
+    agreement_count = total_files - disagreement_count
     total = agreement_count + disagreement_count
     
     agreement_pct = (agreement_count / total * 100) if total > 0 else 0
@@ -59,16 +90,8 @@ def create_final_clear_visualization():
     ax1.set_title('Algorithm Agreement Distribution', fontweight='bold', pad=20, fontsize=16)
     
     # Plot 2: Repository Comparison - Clear Bar Chart
-    repo_data = []
-    for repo in sorted(df['repository'].unique()):
-        repo_df = df[df['repository'] == repo]
-        total = len(repo_df)
-        disagreements = len(repo_df[repo_df['discrepancy'] == 'Yes'])
-        rate = (disagreements / total * 100) if total > 0 else 0
-        repo_data.append({'repo': repo.upper(), 'rate': rate, 'total': total, 'disagreements': disagreements})
-    
-    repo_names = [d['repo'] for d in repo_data]
-    repo_rates = [d['rate'] for d in repo_data]
+    repo_names = [repo.upper() for repo in repo_stats.index]
+    repo_rates = list(repo_stats['rate'])
     
     bars = ax2.bar(repo_names, repo_rates, 
                    color=['#778899', '#2F4F4F', '#696969'],  # Light Slate Gray, Dark Slate Gray, Dim Gray
@@ -79,31 +102,18 @@ def create_final_clear_visualization():
     ax2.set_xlabel('Repository', fontweight='bold', fontsize=18)
     
     # Add clear value labels on bars
-    for bar, data in zip(bars, repo_data):
+    for bar, data in zip(bars, repo_stats.itertuples()):
         height = bar.get_height()
         ax2.text(bar.get_x() + bar.get_width()/2., height + max(repo_rates)*0.01,
-                f'{height:.2f}%\n({data["disagreements"]:,} of {data["total"]:,})', 
+                f'{height:.2f}%\n({data.disagreements:,} of {data.total:,})', 
                 ha='center', va='bottom', fontsize=12)
     
     ax2.set_ylim(0, max(repo_rates) * 1.2)
     ax2.grid(True, alpha=0.2)
     
     # Plot 3: File Type Analysis - Horizontal bars for clarity
-    file_type_stats = []
-    for ft in df['file_type'].unique():
-        ft_df = df[df['file_type'] == ft]
-        total = len(ft_df)
-        disagreements = len(ft_df[ft_df['discrepancy'] == 'Yes'])
-        rate = (disagreements / total * 100) if total > 0 else 0
-        if total >= 10:  # Only include file types with sufficient data
-            file_type_stats.append({
-                'file_type': ft.upper(),
-                'total': total,
-                'disagreements': disagreements,
-                'rate': rate
-            })
-    
-    ft_df = pd.DataFrame(file_type_stats).sort_values('rate', ascending=True)
+    ft_df = (ft_stats.rename(index=str.upper).rename_axis('file_type').reset_index()
+             .sort_values('rate', ascending=True))
     
     colors_ft = plt.cm.viridis(np.linspace(0, 1, len(ft_df)))
     bars = ax3.barh(ft_df['file_type'], ft_df['rate'], 
@@ -128,19 +138,17 @@ def create_final_clear_visualization():
     ax4.axis('off')
     
     # Calculate comprehensive statistics
-    total_files = len(df)
-    total_disagreements = len(df[df['discrepancy'] == 'Yes'])
     overall_agreement_rate = ((total_files - total_disagreements) / total_files * 100) if total_files > 0 else 0
     overall_disagreement_rate = (total_disagreements / total_files * 100) if total_files > 0 else 0
     
     # Find best and worst performers
-    best_repo = min(repo_data, key=lambda x: x['rate'])
-    worst_repo = max(repo_data, key=lambda x: x['rate'])
+    best_repo = {'repo': repo_stats['rate'].idxmin().upper(), 'rate': repo_stats['rate'].min()}
+    worst_repo = {'repo': repo_stats['rate'].idxmax().upper(), 'rate': repo_stats['rate'].max()}
     
     # Most/least problematic file types
-    if file_type_stats:
-        best_ft = min(file_type_stats, key=lambda x: x['rate'])
-        worst_ft = max(file_type_stats, key=lambda x: x['rate'])
+    if len(ft_df):
+        best_ft = ft_df.loc[ft_df['rate'].idxmin()]
+        worst_ft = ft_df.loc[ft_df['rate'].idxmax()]
     else:
         best_ft = worst_ft = {'file_type': 'N/A', 'rate': 0}
     
@@ -192,8 +200,8 @@ Key Findings:
     print(f"Repository with best agreement: {best_repo['repo']} ({best_repo['rate']:.2f}% disagreement)")
     print(f"=" * 50)
     
-    return df
+    return counts
 
 if __name__ == "__main__":
-    df = create_final_clear_visualization()
+    counts = create_final_clear_visualization()
     print("\nVISUALIZATION COMPLETE!")